@@ -0,0 +1,40 @@
+""" Measure how many bytes every item takes.
+Usage: python benchmarks/item_memory.py [count]
+"""
+import os
+import sys
+import tracemalloc
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from Game.core import Engine, Item
+
+def measure(build, count: int) -> float:
+    """ Bytes allocated per item by `build(count)` """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objects = build(count)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del objects
+    return (after - before) / count
+
+def bare_items(count: int) -> list:
+    return [Item('tile', i, 0, 0, '.') for i in range(count)]
+
+def map_items(count: int) -> Engine:
+    side = int(count ** 0.5)
+    game = Engine(side, side, lambda action, x, y: [x, y], input='stdin')
+    for i in range(side * side):
+        game.add_item('tile', i // side, i % side, '.')
+    return game
+
+def empty_map(count: int) -> Engine:
+    side = int(count ** 0.5)
+    return Engine(side, side, lambda action, x, y: [x, y], input='stdin')
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    bare = measure(bare_items, count)
+    on_map = measure(map_items, count) - measure(empty_map, count)
+    print(f'Item objects:      {bare:8.1f} bytes/item')
+    print(f'Items on the map:  {on_map:8.1f} bytes/item (excluding the empty map)')
@@ -0,0 +1,175 @@
+""" Benchmark suite of the engine.
+Every case builds a headless `Engine`, runs it with a scripted input and reports
+steps per second, render time, lookup time and peak memory. Results are written as JSON,
+so runs can be compared over time.
+
+Usage: python benchmarks/run.py [--quick] [--output results.json] [--only sizes,density,...]
+"""
+from contextlib import redirect_stdout
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from Game.core import Engine
+from Game.inputs import ScriptedInput
+from Game.render import DiffRenderer
+
+MOVES = {'up': (-1, 0), 'down': (1, 0), 'left': (0, -1), 'right': (0, 1)}
+
+def move(action, x, y):
+    dx, dy = MOVES[action]
+    return [x + dx, y + dy]
+
+def build(size: int, density: float, timers: int = 0, callbacks: int = 0, steps: int = 0, seed: int = 0) -> Engine:
+    """ Build a `size x size` map with `density` of its tiles holding an item.
+    The character walks back and forth for `steps` steps.
+    """
+    rng = random.Random(seed)
+    keys = ['d', 'a'] * (steps // 2)
+    game = Engine(size, size, move, size // 2, size // 2, input=ScriptedInput(keys))
+    count = int(size * size * density)
+    tiles = rng.sample(range(size * size), count) if count else []
+    game.update_map([('add', 'tile', t // size, t % size, rng.choice('.,*#'), {'block': rng.random() < 0.1})
+                     for t in tiles])
+    for i in range(timers):
+        game.timer(rng.randint(1, max(steps, 1) * 2), lambda game: None)
+    for i in range(callbacks):
+        game.subscribe('step_end', lambda game: None)
+    return game
+
+def run_steps(game: Engine) -> float:
+    """ Run the game until the input runs out @return steps per second """
+    start = time.perf_counter()
+    for timestamp in game.start(render=False): pass
+    return game._timestamp / (time.perf_counter() - start)
+
+def render_time(game: Engine, renderer = None, repeat: int = 3) -> float:
+    """ @return seconds per frame """
+    renderer = renderer or game.default_map_renderer
+    with redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        for _ in range(repeat): renderer(game)
+    return (time.perf_counter() - start) / repeat
+
+def find_time(game: Engine, repeat: int = 100) -> float:
+    """ @return seconds per selective `find_item` """
+    start = time.perf_counter()
+    for _ in range(repeat): game.find_item(symbol='#', block=True)
+    return (time.perf_counter() - start) / repeat
+
+def peak_memory(build_game) -> int:
+    """ @return peak bytes allocated while building a game """
+    tracemalloc.start()
+    game = build_game()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del game
+    return peak
+
+def case(size: int, density: float, timers: int = 0, callbacks: int = 0, steps: int = 2000, max_render: int = 1000) -> dict:
+    params = dict(size=size, density=density, timers=timers, callbacks=callbacks)
+    start = time.perf_counter()
+    game = build(size, density, timers, callbacks, steps)
+    result = dict(params, steps=steps, build_s=time.perf_counter() - start, items=len(game._items))
+    result['steps_per_s'] = run_steps(game)
+    result['find_item_us'] = find_time(game) * 1e6
+    if size <= max_render:
+        result['render_ms'] = render_time(game) * 1000
+        result['diff_render_ms'] = render_time(game, DiffRenderer(io.StringIO()), repeat=4) * 1000
+    result['peak_bytes'] = peak_memory(lambda: build(size, density, timers, callbacks))
+    return result
+
+def batch_vs_loop(size: int = 200) -> dict:
+    """ Compare `update_map` against the equivalent `add_item` loop """
+    loop = Engine(size, size, move, input=ScriptedInput([]))
+    start = time.perf_counter()
+    for t in range(size * size): loop.add_item('tile', t // size, t % size, '.')
+    loop_s = time.perf_counter() - start
+
+    batch = Engine(size, size, move, input=ScriptedInput([]))
+    start = time.perf_counter()
+    batch.update_map([('add', 'tile', t // size, t % size, '.') for t in range(size * size)])
+    batch_s = time.perf_counter() - start
+    return dict(size=size, add_item_loop_s=loop_s, update_map_s=batch_s, speedup=loop_s / batch_s)
+
+def entities(count: int, size: int = 500, steps: int = 100) -> dict:
+    """ Step `count` wandering entities every tick """
+    rng = random.Random(0)
+    game = Engine(size, size, move, 0, 0, input=ScriptedInput(['d', 'a'] * (steps // 2)))
+    wander = lambda entity: rng.choice('uldr')
+    actions = {'u': 'up', 'l': 'left', 'd': 'down', 'r': 'right'}
+    clamp = lambda action, x, y: [min(max(v, 0), size - 1) for v in move(actions[action], x, y)]
+    for _ in range(count):
+        game.add_entity('npc', rng.randrange(size), rng.randrange(size), 'n', clamp, wander)
+    start = time.perf_counter()
+    for timestamp in game.start(render=False): pass
+    return dict(entities=count, tick_ms=(time.perf_counter() - start) / game._timestamp * 1000)
+
+def pathfinding(size: int, changes: int = 50) -> dict:
+    """ Build a distance field to the center of a `size x size` map with 10% walls, 
+    then fix it after walls are added one by one, and find a route across the map
+    """
+    rng = random.Random(0)
+    game = build(size, 0.1)
+    target = [(size // 2, size // 2)]
+    start = time.perf_counter()
+    game.distance_field(target)
+    field_s = time.perf_counter() - start
+    start = time.perf_counter()
+    empty = [(x, y) for x in range(size) for y in range(size) if game.map[x][y] is None]
+    for x, y in rng.sample(empty, changes):
+        game.add_item('wall', x, y, '#', block=True)
+        game.distance_field(target)
+    update_ms = (time.perf_counter() - start) / changes * 1000
+    start = time.perf_counter()
+    game.find_path(0, 0, size - 1, size - 1)
+    path_s = time.perf_counter() - start
+    return dict(size=size, field_s=field_s, field_update_ms=update_ms, find_path_s=path_s)
+
+SUITES = {
+    'sizes':     lambda quick: [case(size, 0.01) for size in ([10, 100, 500] if quick else [10, 100, 500, 1000, 2000, 4000])],
+    'density':   lambda quick: [case(200, density) for density in [0, 0.01, 0.1, 0.5, 1]],
+    'timers':    lambda quick: [case(100, 0.01, timers=n) for n in ([0, 100, 10000] if quick else [0, 100, 10000, 100000])],
+    'callbacks': lambda quick: [case(100, 0.01, callbacks=n) for n in [0, 10, 100]],
+    'batch':     lambda quick: [batch_vs_loop(100 if quick else 300)],
+    'entities':  lambda quick: [entities(n) for n in ([100, 10000] if quick else [100, 1000, 10000, 30000])],
+    'pathfinding': lambda quick: [pathfinding(size) for size in ([100, 300] if quick else [100, 300, 1000])],
+}
+
+def metadata() -> dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(__file__)).stdout.strip()
+    except OSError:
+        commit = None
+    return dict(time=time.strftime('%Y-%m-%dT%H:%M:%S'), commit=commit, python=platform.python_version(),
+                platform=platform.platform())
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--quick', action='store_true', help='run smaller sweeps')
+    parser.add_argument('--only', default=','.join(SUITES), help='comma separated suites to run')
+    parser.add_argument('--output', default='bench-results.json', help='where to write the results')
+    args = parser.parse_args()
+
+    results = {'meta': metadata(), 'suites': {}}
+    for name in args.only.split(','):
+        print(f'--- {name} ---', file=sys.stderr)
+        results['suites'][name] = rows = SUITES[name](args.quick)
+        for row in rows:
+            print('  ' + ' '.join(f'{k}={v:.4g}' if isinstance(v, float) else f'{k}={v}' for k, v in row.items()),
+                  file=sys.stderr)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'results written to {args.output}', file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,26 @@
+from .log import DEFAULT_LOGGER
 
 class BaseObject(object):
+    __slots__ = ('debug',)
+    SUBSYSTEM = 'engine'  # which subsystem the messages of this object belong to by default
+
     def __init__(self, debug = False):
         super().__init__()
 
         self.debug = debug
 
-    def log(self, message, level='debug') -> str:
-        if level.lower() == 'debug' and not self.debug: return
+    def log(self, message, level='debug', *args, subsystem=None) -> str:
+        """ Log a message. The message is only formatted with `message % args` if it is going to be logged,
+        so pass the arguments rather than an f-string on hot paths.
+        """
+        logger = self._logger()
+        if level == 'debug' and not self.debug and not logger.levels: return
+        if not logger.enabled(level, subsystem or self.SUBSYSTEM, self.debug): return
 
+        if args: message = message % args
         message = f'[ {level.upper()} ] {message}'
-        print(message)
-        return message
\ No newline at end of file
+        logger.write(message)
+        return message
+
+    def _logger(self):
+        return DEFAULT_LOGGER
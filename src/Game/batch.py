@@ -0,0 +1,75 @@
+""" Run many headless games in parallel, e.g. to tune the game balance with simulated players.
+
+    def build(seed, input):
+        game = Engine(20, 20, move, input=input, seed=seed, log_sink=RingBufferSink())
+        ...
+        return game
+
+    def policy(game):
+        return game.random.choice('wasd') if game._timestamp < 1000 else None
+
+    for result in run_games(build, policy, 10000, metrics=lambda game: {'coins': game.backpack.count('coin')}):
+        ...
+
+The factory, the policy and the metrics function are sent to the worker processes,
+so they have to be picklable, i.e. defined at the top level of a module.
+"""
+from multiprocessing import Pool
+import os
+import time
+
+from .inputs import ScriptedInput
+
+def play(factory, policy, seed, metrics = None, max_steps: int = None, mode: str = 'stdin') -> dict:
+    """ Build a game and play it headless until it ends.
+    @param factory - `factory(seed, input) -> Engine`, which should pass `input` to the `Engine`
+    @param policy - `policy(game) -> event`, called for every event the game asks for. Return `None` to end the game.
+    @param seed - passed to the factory
+    @param metrics - `metrics(game) -> dict` of custom results, called once the game ends
+    @param max_steps - end the game after this many steps
+    @param mode - the kind of events the policy returns. [stdin, pynput]
+    @return a dict of the results:
+            seed, timestamp (final), backpack, metrics, elapsed (seconds), error (`None`, or what the game raised)
+    """
+    result = {'seed': seed, 'timestamp': None, 'backpack': None, 'metrics': None, 'elapsed': 0.0, 'error': None}
+    start = time.perf_counter()
+    try:
+        game = factory(seed, ScriptedInput(policy, mode))
+        for timestamp in game.start(render=False):
+            if max_steps is not None and timestamp is not None and timestamp >= max_steps:
+                game.end()
+                break
+        result['timestamp'] = game._timestamp
+        result['backpack'] = game.backpack
+        if metrics: result['metrics'] = metrics(game)
+    except Exception as e:
+        result['error'] = repr(e)
+    result['elapsed'] = time.perf_counter() - start
+    return result
+
+def run_games(factory, policy, seeds, metrics = None, max_steps: int = None, mode: str = 'stdin',
+              processes: int = None, chunksize: int = None):
+    """ Play many games in a process pool. See `play` for the arguments and results of every game.
+    Results are yielded as soon as the games end, so they are not in the order of the seeds.
+    A game that raises does not stop the others; its result has `error` set.
+    @param seeds - one game is played for each seed. An integer `n` means the seeds `0` to `n - 1`.
+    @param processes - how many worker processes to use. Default to the number of CPUs.
+                       Set 0 to play the games one by one in this process, e.g. for debugging.
+    @param chunksize - how many games are sent to a worker at once. By default it is picked
+                       so that every worker gets about 4 chunks, which keeps the workers busy
+                       without paying the inter-process overhead for every short game.
+    """
+    seeds = list(range(seeds)) if isinstance(seeds, int) else list(seeds)
+    jobs = [(factory, policy, seed, metrics, max_steps, mode) for seed in seeds]
+    if processes == 0:
+        for job in jobs:
+            yield play(*job)
+        return
+
+    processes = processes or os.cpu_count() or 1
+    chunksize = chunksize or max(1, len(jobs) // (processes * 4))
+    with Pool(processes) as pool:
+        yield from pool.imap_unordered(_play, jobs, chunksize)
+
+def _play(job: tuple) -> dict:
+    return play(*job)
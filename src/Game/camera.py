@@ -0,0 +1,71 @@
+import shutil
+from typing import Tuple
+
+class Camera(object):
+    def __init__(self, width: int = None, height: int = None, dead_zone: Tuple[int,int] = (1, 1), reserved_lines: int = 5) -> None:
+        """ A viewport on the map that follows the character. Use it through `Engine(camera=Camera())`.
+        Only the tiles inside the viewport are drawn, so the cost of a frame depends on the screen rather than the map.
+        The character moves freely inside the dead zone, a box in the middle of the viewport,
+        and the viewport only scrolls once the character leaves it. It never scrolls past the edge of the map.
+        @param width - how many tiles are shown in a row. Default to what fits in the terminal.
+        @param height - how many rows are shown. Default to what fits in the terminal.
+        @param dead_zone - (rows, columns) of the dead zone. (1, 1) keeps the character in the center.
+        @param reserved_lines - terminal lines used by things other than the map rows,
+                                e.g. the time, the borders and the input prompt of the default renderer.
+        """
+        super().__init__()
+
+        self.width = width
+        self.height = height
+        self.dead_zone = dead_zone
+        self.reserved_lines = reserved_lines
+        self.x = None  # top row of the viewport on the map
+        self.y = None  # leftmost column of the viewport on the map
+        self.rows = 0  # size of the viewport, at most the size of the map
+        self.cols = 0
+
+    def update(self, game) -> Tuple[int,int,int,int]:
+        """ Fit the viewport to the terminal and move it after the character. Called once per frame by the renderers.
+        @return the viewport (x0, y0, x1, y1). Tiles from (x0, y0) to (x1, y1), excluding (x1, y1), are shown.
+        """
+        self.rows, self.cols = self._size(game)
+        cx, cy = game.character
+        if self.x is None:
+            self.x, self.y = cx - self.rows // 2, cy - self.cols // 2
+        self.x = self._follow(self.x, cx, self.rows, self.dead_zone[0], game.height)
+        self.y = self._follow(self.y, cy, self.cols, self.dead_zone[1], game.width)
+        return self.bounds()
+
+    def bounds(self) -> Tuple[int,int,int,int]:
+        """ @return the viewport (x0, y0, x1, y1) of the last `update` """
+        return self.x, self.y, self.x + self.rows, self.y + self.cols
+
+    def to_screen(self, x: int, y: int) -> Tuple[int,int]:
+        """ Convert a map position into (row, column) of tiles in the viewport.
+        @return the position in the viewport, or `None` if the tile is not shown
+        """
+        row, col = x - self.x, y - self.y
+        if 0 <= row < self.rows and 0 <= col < self.cols: return row, col
+        return None
+
+    def to_map(self, row: int, col: int) -> Tuple[int,int]:
+        """ Convert (row, column) of tiles in the viewport into a map position """
+        return self.x + row, self.y + col
+
+    def _size(self, game) -> Tuple[int,int]:
+        """ @return (rows, columns) of the viewport """
+        if self.width is None or self.height is None:
+            terminal = shutil.get_terminal_size()
+        width = self.width or max((terminal.columns - 2) // game.pixel_width, 1)   # 2 columns of borders
+        height = self.height or max(terminal.lines - self.reserved_lines, 1)
+        return min(height, game.height), min(width, game.width)
+
+    @staticmethod
+    def _follow(origin: int, target: int, size: int, dead_zone: int, limit: int) -> int:
+        """ Scroll one axis of the viewport so that the target is inside the dead zone, and keep it inside the map """
+        dead_zone = min(max(dead_zone, 1), size)
+        low = origin + (size - dead_zone) // 2
+        high = low + dead_zone - 1
+        if target < low:    origin -= low - target
+        elif target > high: origin += target - high
+        return min(max(origin, 0), limit - size)
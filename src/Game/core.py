@@ -1,7 +1,11 @@
 from operator import itemgetter
-from collections import defaultdict
+from collections import deque
 from typing import Callable, Tuple
+import asyncio
+import inspect
 import random
+import time
+import gc
 PYNPUT_AVAILABLE = True
 try:
     from pynput import keyboard
@@ -9,12 +13,24 @@ except ImportError:
     PYNPUT_AVAILABLE = False
 
 from .base import BaseObject
-from .util import hasnone, allnone, pixel_width
+from .events import EventBus, Subscription
+from .log import Logger
+from .pathfinding import Pathfinder, DistanceField
+from .profiler import NULL_PROFILER, StepProfiler, format_stats
+from .registry import ItemRegistry
+from .scheduler import Scheduler, TimerId
+from .stack import ItemStack
+from .storage import ArrayMap, ChunkMap, NUMPY_AVAILABLE
+from .inputs import InputSource, StdinInput, PynputInput
+from .util import hasnone, allnone, pixel_width, padded, callable_name
 
 class Item(BaseObject):
     EVENT = ['enter', 'leave', 'timeout', 'removed']
+    SUBSYSTEM = 'item'
+    __slots__ = ('name', 'x', 'y', 'created', 'life', 'symbol', 'tile', 'block', 'hidden', 'z', 'parent', 
+                 'istouched', '_callback', '_timer')
 
-    def __init__(self, name, x, y, create_time, symbol='*', life=None, block=False, hidden=False, debug=False, parent=None) -> None:
+    def __init__(self, name, x, y, create_time, symbol='*', life=None, block=False, hidden=False, z=None, debug=False, parent=None) -> None:
         """ Create a new item/tile on the map.
         @param name - the name of this item. 
                       Can be used to remove certain type of tiles on the map.
@@ -27,6 +43,8 @@ class Item(BaseObject):
         @param block - whether this item should block user's movement.
         @param hidden - whether this item should be shown on the map. 
                         Note that all events are still triggered even if the item is hidden.
+        @param z - z-order of the item on its tile. Items with a z-order are stacked with the other items on the tile,
+                   and items without one replace them. See `Engine.add_item`.
         @param debug - whether to print the debugging messages. 
                        (warnings and errors will always be printed)
         """
@@ -38,14 +56,16 @@ class Item(BaseObject):
         self.created = create_time # when was this item created
         self.life = life           # how long will this item exists
         self.symbol = symbol       # what to show on the map
+        self.tile = symbol         # the symbol padded to the pixel width of the map
         self.block = block         # whether to block user's movement
         self.hidden = hidden       # whether to show on the map
+        self.z = z                 # z-order on a stacked tile
         self.parent = parent       # which game did this item come from
 
         self.istouched = False
 
-        self._callback = {e: [] for e in self.EVENT}
-        self._timer = {}
+        self._callback = None      # `EventBus` of this item, allocated on the first `subscribe`
+        self._timer = None         # id -> [time, callback], allocated on the first `timer`
     
     def position(self) -> list:
         """ Get current position of this item. """
@@ -55,14 +75,27 @@ class Item(BaseObject):
         """ Set whether the item should be shown in the map or not.
         Note that all events are still triggered even if the item is hidden.
         """
+        if self.parent: self.parent._touch_tile(self.x, self.y)
         self.hidden = not flag
-        self.log(f'Item-{self.name}: set hidden to {self.hidden!r}')
+        if self.parent: self.parent._on_item_update(self)
+        self.log('Item-%s: set hidden to %r', 'debug', self.name, self.hidden)
+        return
+
+    def set_symbol(self, symbol: str) -> None:
+        """ Change what to show on the map """
+        if self.parent: self.parent._touch_tile(self.x, self.y)
+        self.symbol = symbol
+        self.tile = padded(symbol, self.parent.pixel_width) if self.parent else symbol
+        if self.parent: self.parent._on_item_update(self)
+        self.log('Item-%s: set symbol to %r', 'debug', self.name, self.symbol)
         return
 
     def set_block(self, flag: bool = True) -> None:
         """ Set whether the item should block user or not """
+        if self.parent: self.parent._touch_tile(self.x, self.y)
         self.block = flag
-        self.log(f'Item-{self.name}: set block to {self.block!r}')
+        if self.parent: self.parent._on_item_update(self)
+        self.log('Item-%s: set block to %r', 'debug', self.name, self.block)
         return
     
     ### ------ EVENT FUNCTIONALITIES ------ ###
@@ -75,32 +108,36 @@ class Item(BaseObject):
             self.log(f'Item-{self.name}: event {event!r} doesn\'t exist. Event not fired', 'warn')
             return False
 
-        self.log(f'Item-{self.name}: fire {event!r} event')
+        self.log('Item-%s: fire %r event', 'debug', self.name, event)
         if event == 'timeout':
-            self._timer[args[0]][1](self)
-            del self._timer[args[0]]
+            callback = self._timer.pop(args[0])[1]
+            if callback: self._call(callback)
         elif event == 'enter':
             self.istouched = True
         elif event == 'leave':
             self.istouched = False
 
-        for cb in self._callback[event]:
-            cb(self)
+        if self._callback is not None:
+            self._callback.dispatch(event, self._call)
         return True
     
-    def subscribe(self, event: str, callback: Callable) -> bool:
+    def subscribe(self, event: str, callback: Callable, priority: int = 0, once: bool = False) -> Subscription:
         """ Subscribe to an event on this item. 
         The callback will be triggered once the event is fired.
-        @return whether the callback is successfully subscribed.
+        @param priority - callbacks with higher priority are called first
+        @param once - whether to unsubscribe the callback once it's called
+        @return a `Subscription` handle, which can `cancel` the subscription in O(1), 
+                or `False` if the callback is not subscribed.
         """
         if event not in self.EVENT:
             self.log(f'Item-{self.name}: event {event!r} not allowed. Event not registered', 'warn')
             self.log(f'Item-{self.name}: Available events: {self.EVENT}', 'warn')
             return False
         
-        self._callback[event].append(callback)
-        self.log(f'Item-{self.name}: callback {callback.__name__!r} subscribes to the event {event!r}')
-        return True
+        if self._callback is None: self._callback = EventBus()
+        subscription = self._callback.subscribe(event, callback, priority, once)
+        self.log('Item-%s: callback %r subscribes to the event %r', 'debug', self.name, callable_name(callback), event)
+        return subscription
 
     def unsubscribe(self, event: str, callback: Callable) -> bool:
         """ Unsubscribe a certain function from an event of this item.
@@ -109,63 +146,185 @@ class Item(BaseObject):
         if event not in self.EVENT:
             self.log(f'Item-{self.name}: event {event!r} not found', 'warn')
             return False
-        if callback not in self._callback[event]:
-            self.log(f'Item-{self.name}: callback {callback.__name__!r} not found', 'warn')
+        subscription = self._callback.find(event, callback) if self._callback else None
+        if subscription is None:
+            self.log(f'Item-{self.name}: callback {callable_name(callback)!r} not found', 'warn')
             return False
 
-        self._callback[event].remove(callback)
-        self.log(f'Item-{self.name}: callback {callback.__name__!r} removed from the event {event!r}')
+        subscription.cancel()
+        self.log(f'Item-{self.name}: callback {callable_name(callback)!r} removed from the event {event!r}')
         return True
     
-    def timer(self, time: int, callback: Callable) -> int:
+    def timer(self, time: int, callback: Callable = None) -> int:
         """ Set up a timer. The callback will be triggered once the time is out.
-        @return an timer id, which can be used to cancel the timer.
+        @return an timer id, which can be used to cancel the timer. 
+                In `Engine.run`, it can also be awaited until the timer is fired.
         """
-        id = random.randint(1000, 10000)
+        if self.parent is None:
+            self.log(f'Item-{self.name}: item is not on any map. Timer not added', 'error')
+            return None
+        id = TimerId(self.parent._scheduler.schedule(self.parent._due(time), self._timeout), self.parent)
+        if self._timer is None: self._timer = {}
         self._timer[id] = [time, callback]
-        self.log(f'Item-{self.name}: timer {id} is added. handler: {callback.__name__!r}')
+        self.log('Item-%s: timer %d is added. handler: %r', 'debug', self.name, id, callable_name(callback), subsystem='timer')
         return id
     
     def remove_timer(self, id: int) -> bool:
         """ Remove the existing timer.
         @return whether the timer is successfully removed.
         """
-        if id not in self._timer:
+        if not self._timer or id not in self._timer:
             self.log(f'Item-{self.name}: timer {id} not found ({self.name})', 'warn')
             return False
         del self._timer[id]
-        self.log(f'Item-{self.name}: timer {id} is removed')
+        self.parent._cancel_timer(id)
+        self.log('Item-%s: timer %d is removed', 'debug', self.name, id, subsystem='timer')
         return True
     
 
     ### ------ UTILITIES ------ ###
     
-    def _tik_timer(self) -> None:
-        dead = []
-        for id, obj in self._timer.items():
-            obj[0] -= 1
-            self.log(f'Item-{self.name}: timer {id} remain time: {obj[0]}')
-            if obj[0] <= 0:
-                dead.append(id)
-        for id in dead:
-            self.fire('timeout', id)
-
-    def _check_alive(self, timestamp) -> bool:
-        """ Check for daily update and return its current status. 
-        Please do not call this function, or the whole timeline of this item might be broken.
-        """
-        if self.life and (timestamp > self.created + self.life):
-            self.hidden = True
+    def _timeout(self, id: int) -> None:
+        """ Called by the scheduler of the engine once a timer of this item is due """
+        self.fire('timeout', id)
+
+    def _restore_timer(self, due: int, callback: Callable) -> int:
+        """ Set up a timer that is fired at the given timestamp. Used when loading a snapshot. """
+        id = TimerId(self.parent._scheduler.schedule(due, self._timeout), self.parent)
+        if self._timer is None: self._timer = {}
+        self._timer[id] = [due - self.parent._timestamp, callback]
+        return id
+
+    def _logger(self):
+        return self.parent.logger if self.parent else super()._logger()
+
+    def _call(self, callback: Callable) -> None:
+        """ Call a callback of this item. Coroutine callbacks are run by the engine. """
+        if self.parent: self.parent._invoke(callback, self)
+        else:           callback(self)
+
+    def _cancel_timers(self) -> None:
+        """ Cancel all pending timers. Called once the item is removed from the map. """
+        if not self._timer: return
+        for id in self._timer:
+            self.parent._cancel_timer(id)
+        self._timer = None
+
+
+class Entity(BaseObject):
+    EVENT = ['enter', 'leave', 'collide', 'removed']
+    SUBSYSTEM = 'entity'
+    __slots__ = ('id', 'name', 'x', 'y', 'symbol', 'tile', 'block', 'hidden', 'move_cb', 'policy', 'parent', '_callback')
+
+    def __init__(self, id, name, x, y, symbol, move_function, policy=None, block=False, hidden=False, debug=False, parent=None) -> None:
+        """ A moving thing on the map, e.g. an NPC. Create it with `Engine.add_entity`.
+        @param id - a number that identifies this entity in the game
+        @param name - the name of this entity
+        @param x - current x position of the entity
+        @param y - current y position of the entity
+        @param symbol - what to show on the map
+        @param move_function - the movement controller `function(action, x, y) -> [x, y]`, like the one of the engine
+        @param policy - `function(entity) -> action`, called every step to decide where to move.
+                        Return `None` to stay. Without a policy, the entity only moves through `move`.
+        @param block - whether this entity blocks the character and other entities
+        @param hidden - whether this entity should be shown on the map
+        @param debug - whether to print the debugging messages.
+        """
+        super().__init__(debug)
+
+        self.id = id
+        self.name = name
+        self.x = x
+        self.y = y
+        self.symbol = symbol
+        self.tile = symbol          # the symbol padded to the pixel width of the map
+        self.block = block
+        self.hidden = hidden
+        self.move_cb = move_function
+        self.policy = policy
+        self.parent = parent
+
+        self._callback = None       # `EventBus` of this entity, allocated on the first `subscribe`
+
+    def position(self) -> list:
+        """ Get current position of this entity. """
+        return [self.x, self.y]
+
+    def move(self, action) -> bool:
+        """ Move the entity with its move function. 
+        The entity stays if the new tile is outside the map, or blocked by an item or a blocking entity.
+        @return `true` if the entity is moved
+        """
+        x, y = self.move_cb(action, self.x, self.y)
+        return self.parent._move_entity(self, x, y)
+
+    def set_policy(self, policy: Callable) -> None:
+        """ Change how the entity decides where to move every step. Set `None` to stop stepping it. """
+        self.policy = policy
+        if self.parent: self.parent._on_entity_policy(self)
+
+    def teleport(self, x: int, y: int) -> bool:
+        """ Move the entity to a tile directly, with the same checks as `move`
+        @return `true` if the entity is moved
+        """
+        return self.parent._move_entity(self, x, y)
+
+    ### ------ EVENT FUNCTIONALITIES ------ ###
+
+    def fire(self, event: str, *args) -> bool:
+        """ Fire a certain event. Callbacks are called with `(entity, *args)`.
+        `enter` and `leave` get the item of the tile, and `collide` gets the item or entity that blocks the way.
+        @return whether the event is successfully fired.
+        """
+        if event not in self.EVENT:
+            self.log(f'Entity-{self.name}: event {event!r} doesn\'t exist. Event not fired', 'warn')
             return False
-        self._tik_timer()
+
+        self.log('Entity-%s: fire %r event', 'debug', self.name, event)
+        if self._callback is not None:
+            self._callback.dispatch(event, lambda callback: self.parent._invoke(callback, self, *args))
+        return True
+
+    def subscribe(self, event: str, callback: Callable, priority: int = 0, once: bool = False) -> Subscription:
+        """ Subscribe to an event on this entity.
+        @param priority - callbacks with higher priority are called first
+        @param once - whether to unsubscribe the callback once it's called
+        @return a `Subscription` handle, or `False` if the callback is not subscribed.
+        """
+        if event not in self.EVENT:
+            self.log(f'Entity-{self.name}: event {event!r} not allowed. Event not registered', 'warn')
+            self.log(f'Entity-{self.name}: Available events: {self.EVENT}', 'warn')
+            return False
+
+        if self._callback is None: self._callback = EventBus()
+        subscription = self._callback.subscribe(event, callback, priority, once)
+        self.log('Entity-%s: callback %r subscribes to the event %r', 'debug', self.name, callable_name(callback), event)
+        return subscription
+
+    def unsubscribe(self, event: str, callback: Callable) -> bool:
+        """ Unsubscribe a certain function from an event of this entity.
+        @return whether the event is successfully unsubscribed.
+        """
+        subscription = self._callback.find(event, callback) if self._callback else None
+        if subscription is None:
+            self.log(f'Entity-{self.name}: callback {callable_name(callback)!r} not found', 'warn')
+            return False
+
+        subscription.cancel()
+        self.log(f'Entity-{self.name}: callback {callable_name(callback)!r} removed from the event {event!r}')
         return True
 
+    def _logger(self):
+        return self.parent.logger if self.parent else super()._logger()
+
 
 class Engine(BaseObject):
     # available keyboard events
     KB_EVENT = ['press', 'release'] 
     # default events
     DEFAULT_EVENT = ['onstart', 'update_map', 'step_end', 'onend'] 
+    # events that are never deferred by `defer_events`
+    LIFECYCLE_EVENT = ('onstart', 'step_end', 'onend')
     # default keymap of movement control
     CONTROL_KEY = {
         # default key for stdin
@@ -190,6 +349,11 @@ class Engine(BaseObject):
                  character_char = 'x', 
                  map_renderer = None, 
                  map_filler = ' ',
+                 map_storage = 'list',
+                 log_sink = None,
+                 seed = None,
+                 camera = None,
+                 fov = None,
                  debug = False) -> None:
         """
         @param width - the width of the map
@@ -199,18 +363,33 @@ class Engine(BaseObject):
         @param init_x - initial position x of the character
         @param init_y - initial position y of the character
         @param input - input mode. [stdin, pynput]
+                       An `inputs.InputSource` can also be given, e.g. `inputs.ScriptedInput` to run without a keyboard.
         @param pixel_width - the width of every pixel. Set this if you're using emoji in the map.
         @param character_char - the char used to resemble the character
-        @param map_renderer - the default map render function.
+        @param map_renderer - the default map render function. 
+                              Use `render.DiffRenderer()` to redraw only the changed tiles.
         @param map_filler - what to show if there's no item on the map.
+        @param map_storage - how the map is stored. [list, numpy]
+                             `numpy` keeps the tiles in arrays, which makes rendering and area queries faster on large maps.
+                             A `storage.ChunkMap` can also be given for huge worlds, which keeps only the chunks
+                             around the character in memory.
+        @param log_sink - where the log messages go. Default to stdout.
+                          Use `log.RingBufferSink` or `log.FileSink` to keep them from interleaving with the map.
+        @param seed - seed of `Engine.random`. A random seed is picked by default.
+                      Use `Engine.random` for the randomness of the game, so that recordings replay the same way.
+        @param camera - a `camera.Camera` to only draw the part of the map around the character. 
+                        The whole map is drawn by default.
+        @param fov - a `fov.FieldOfView` to only draw the tiles the character can see. Everything is drawn by default.
         @param debug - whether to print the debug messages. (warnings and errors are always printed)
         """
         super().__init__(debug)
+        self.logger = Logger(log_sink)
 
         self.width = width
         self.height = height
         self.move_cb = move_function
-        self.input = input
+        self.input = input.mode if isinstance(input, InputSource) else input
+        self.input_source = input if isinstance(input, InputSource) else None
 
         self.pixel_width = pixel_width
         self.character_char = character_char
@@ -218,26 +397,52 @@ class Engine(BaseObject):
         self.character = [init_x if init_x is not None else int(height/2), 
                           init_y if init_y is not None else int(width/2)]
         self.map_filler = map_filler
-        self.map = [[None for _ in range(width)]       # map information
-                          for _ in range(height)]
+        self.camera = camera                           # which part of the map is drawn, see `viewport`
+        self.fov = fov                                 # which tiles the character can see, see `viewport`
+        self.map = self._create_map(map_storage)       # map information
         self.backpack = []                             # small backpack
         self.isend = False                             # whether the game has ended
+        self.seed = seed if seed is not None else random.randrange(2 ** 32)
+        self.random = random.Random(self.seed)         # random generator of the game, see `record`
 
         self._timestamp = 0
-        self._kb_callback = {e: defaultdict(list) for e in self.KB_EVENT}
-        self._subscription = {e: [] for e in self.DEFAULT_EVENT}
+        self._items = ItemRegistry()                   # all live items on the map
+        self._stacks = {}                              # tiles holding more than one item: (x, y) -> `ItemStack`
+        self._entities = {}                            # all entities: id -> entity
+        self._stepping = {}                            # entities with a policy, stepped every step: entity -> None
+        self._spatial = {}                             # (x, y) -> entities on the tile: {entity: None}
+        self._entity_id = 0                            # id of the next entity
+        self._kb_callback = {e: EventBus() for e in self.KB_EVENT}  # keyboard event -> bus of keys
+        self._subscription = EventBus(self.DEFAULT_EVENT)
+        self._deferred = None                          # events waiting for the end of the step, see `defer_events`
         self._layer_renderer = {'map': map_renderer or self.default_map_renderer}
-        self._timer = {}
+        self._scheduler = Scheduler()                  # engine timers, item timers and item lifetimes
+        self._timer = {}                               # pending engine timers: id -> [time, callback]
+        self._life_timer = {}                          # item -> id of its life expiry timer
+        self._waiters = {}                             # timer id -> futures awaiting the timer
+        self._loop = None                              # the event loop running `run`
+        self._tasks = set()                            # pending tasks of coroutine callbacks
+        self._profiler = None                          # see `enable_profiling`
+        self._recorder = None                          # see `record`
+        self._pathfinder = None                        # see `find_path`, created on the first use
+        self._tile_watchers = []                       # caches to update after the content of a tile is changed
+        self._touched = []                             # items on the character's tile at the last event check
+        self._tick_lateness = deque(maxlen=1000)       # how late recent real-time ticks started, in seconds
+        self._tick_count = 0                           # ticks run in the real-time mode
+        self._frame_count = 0                          # frames rendered in the real-time mode
         self._pause_event_once = False
 
         self.layer = 'map'                                 # current presenting layer
         self.renderer = self._layer_renderer[self.layer]   # current renderer
+        if self.fov is not None: self.fov.bind(self)
         if not self.input:
             self.input = 'pynput' if PYNPUT_AVAILABLE else 'stdin'
             self.log(f'Autodetect input system: {self.input!r}')
+        if self.input_source is None:
+            self.input_source = {'stdin': StdinInput, 'pynput': PynputInput}.get(self.input, lambda: None)()
         self.log(f'Input system {self.input!r} is used')
 
-    def start(self) -> int:
+    def start(self, render: bool = True, realtime: bool = False, tick_rate: float = 10, max_fps: float = None) -> int:
         """ Start the game loop. 
         The current timestamp is yielded in real-time, right before rendering the map.  
         The logic loop of the game is:
@@ -247,18 +452,124 @@ class Engine(BaseObject):
          4. fire `end_step` event
          5. back to (1)
         Note that your code in game loop will be processed in between (1) and (2).
+        The game also ends once the input source runs out of events.
+        By default the game is turn-based: it only moves on after a valid event.
+        In the real-time mode, a step runs every `1 / tick_rate` seconds whether there is any event or not,
+        with all events received since the last step. See `tick_stats` for how well the rate is kept.
+        @param render - whether to render the map. Turn this off to simulate the game at full speed.
+        @param realtime - whether to run in the real-time mode.
+        @param tick_rate - steps per second in the real-time mode.
+        @param max_fps - at most how many frames are rendered per second in the real-time mode. Default to `tick_rate`.
         """
+        if realtime:
+            yield from self._realtime_loop(render, tick_rate, max_fps or tick_rate)
+            return
         self.fire('onstart')
         while not self.isend:
             yield self._timestamp 
 
             # YOUR CODE IN THE LOOP WILL BE PUT RIGHT HERE
 
-            self.renderer(self)
+            if render: self._render()
+            prof, start = self._profiler, time.perf_counter()
             while not self._listen(): pass
+            if prof: prof.lap('listen', start)
             self._next()
         yield None
 
+    async def run(self, render: bool = True, realtime: bool = False, tick_rate: float = 10, max_fps: float = None) -> int:
+        """ The asyncio version of `start`. Use it as `async for timestamp in game.run(): ...`.
+        Callbacks may be coroutine functions. They are run as tasks, so a slow handler overlaps 
+        with the game loop instead of delaying the step. Timer ids can be awaited, e.g. `await game.timer(3)`.
+        Blocking input sources are read in a worker thread, so tasks keep running while waiting for the player.
+        In the real-time mode, the map is rendered by its own task at `max_fps`.
+        Pending callback tasks are awaited once the game ends.
+        """
+        self._loop = asyncio.get_running_loop()
+        render_task = None
+        try:
+            if realtime:
+                period = 1 / tick_rate
+                self.input_source.start(self)
+                if render: render_task = self._loop.create_task(self._render_task(max_fps or tick_rate))
+            self.fire('onstart')
+            scheduled = time.perf_counter()
+            while not self.isend:
+                yield self._timestamp
+
+                # YOUR CODE IN THE LOOP WILL BE PUT RIGHT HERE
+
+                if realtime:
+                    start = time.perf_counter()
+                    for event in self._coalesce(self.input_source.poll()):
+                        self._dispatch(event)
+                        if self.isend: break
+                    if self._profiler: self._profiler.lap('listen', start)
+                else:
+                    if render: self._render()
+                    prof, start = self._profiler, time.perf_counter()
+                    while not await self._alisten(): pass
+                    if prof: prof.lap('listen', start)
+                self._next()
+
+                if realtime:
+                    scheduled, delay = self._tick_delay(scheduled, period)
+                    await asyncio.sleep(delay)
+                    self._record_tick(scheduled)
+                else:
+                    await asyncio.sleep(0) # let the callback tasks run
+            if self._tasks: await asyncio.gather(*self._tasks, return_exceptions=True)
+            yield None
+        finally:
+            if render_task: render_task.cancel()
+            self._loop = None
+
+    def set_log_level(self, subsystem: str, level: str) -> None:
+        """ Set the minimum level of log messages for a subsystem. [engine, item, entity, timer, input]
+        @param level - one of debug, info, warn, error, or `None` to follow the `debug` flag again.
+        """
+        self.logger.set_level(subsystem, level)
+
+    def enable_profiling(self, window: int = 1000, dump_every: int = None, dump: Callable = None) -> None:
+        """ Start recording the time of every phase of a step (render, listen, check_event, tik_timer, step_end)
+        and of every callback, as well as the number of items and timers per step. See `stats`.
+        @param window - how many recent samples the percentiles are computed from
+        @param dump_every - dump the statistics every this many steps
+        @param dump - function `dump(stats)` to receive the statistics. Default to writing a table to the log sink.
+        """
+        self._profiler = StepProfiler(window, dump_every, dump or (lambda stats: self.logger.write(format_stats(stats))))
+        self.log('profiling enabled')
+
+    def disable_profiling(self) -> None:
+        """ Stop recording, and drop the recorded statistics """
+        self._profiler = None
+        self.log('profiling disabled')
+
+    def stats(self) -> dict:
+        """ Get the recorded statistics. Times are in milliseconds.
+        @return `steps`, plus `phases` and `callbacks` (by qualified name), each with count, mean, p50, p95, p99 and max,
+                and `counts` of items and timers per step. Only current counts are given if profiling is not enabled.
+        """
+        if self._profiler is None:
+            return {'steps': 0, 'phases': {}, 'callbacks': {}, 
+                    'counts': {'items': {'current': len(self._items)}, 'timers': {'current': len(self._scheduler)}}}
+        stats = self._profiler.stats()
+        stats['counts'].setdefault('items', {})['current'] = len(self._items)
+        stats['counts'].setdefault('timers', {})['current'] = len(self._scheduler)
+        return stats
+
+    def tick_stats(self) -> dict:
+        """ Statistics of the real-time mode. Lateness is how late a step starts compared to its schedule.
+        @return `ticks` and `frames` so far, and the `mean`, `p95` and `max` lateness of recent ticks in milliseconds.
+        """
+        lateness = sorted(self._tick_lateness)
+        stats = {'ticks': self._tick_count, 'frames': self._frame_count, 'mean': 0.0, 'p95': 0.0, 'max': 0.0}
+        if lateness:
+            stats['mean'] = sum(lateness) / len(lateness) * 1000
+            stats['p95'] = lateness[int(len(lateness) * 0.95) - 1 if len(lateness) >= 20 else -1] * 1000
+            stats['max'] = lateness[-1] * 1000
+        return stats
+
     def end(self) -> None:
         """ End the game immediately """
         self.isend = True
@@ -272,7 +583,7 @@ class Engine(BaseObject):
         """ Get or set the character's position.
         @return character's position after updated.
         """
-        # [TODO] multiple characters
+        # the character is the one the player moves, other characters are entities, see `add_entity`
         if x is not None: self.character[0] = x
         if y is not None: self.character[1] = y
         return self.character[:]
@@ -280,12 +591,62 @@ class Engine(BaseObject):
     def move(self, direction) -> None:
         x, y = self.move_cb(direction, *self.position())
         if self.map[x][y] and self.map[x][y].block:
-            self.log(f'blocked by item')
+            self.log('blocked by item')
+            return
+        if self._entity_blocking(x, y):
+            self.log('blocked by entity')
             return
         self.position(x, y)
-        self.log(f'move to ({x}, {y})')
+        self.log('move to (%d, %d)', 'debug', x, y)
         return
 
+    ### ------ ENTITY FUNCTIONALITIES ------ ###
+
+    def add_entity(self, name: str, x: int, y: int, symbol: str, move_function: Callable = None, policy: Callable = None, 
+                   block: bool = False, hidden: bool = False) -> Entity:
+        """ Add a moving entity, e.g. an NPC, onto the map. See `Entity`.
+        Entities are kept in a spatial hash, so moving one, checking what blocks it and
+        firing the `enter`/`leave` events of the tiles take constant time.
+        Every step, before the events of the character are checked, every entity with a policy is moved.
+        @param move_function - the movement controller of this entity. Default to the one of the engine.
+        @param policy - `function(entity) -> action`, called every step to decide where to move
+        @param block - whether this entity blocks the character and other entities
+        @return the created `Entity`
+        """
+        if not self._in_map(x, y):
+            self.log(f'({x}, {y}) is outside the map. Entity {name!r} not added', 'error')
+            return None
+        if pixel_width(symbol) > self.pixel_width:
+            self.log(f"Entity symbol is longer than the pixel width of your map. This may cause some problem during the rendering", 'warn')
+
+        entity = Entity(self._entity_id, name, x, y, symbol or ' ', move_function or self.move_cb, policy, block, hidden,
+                        debug=self.debug, parent=self)
+        entity.tile = padded(entity.symbol, self.pixel_width)
+        self._entity_id += 1
+        self._add_entity(entity)
+        self.log('Entity %r is added to (%d, %d)', 'debug', name, x, y, subsystem='entity')
+        return entity
+
+    def remove_entity(self, entity: Entity) -> bool:
+        """ Remove an entity from the map. Its `removed` event is fired.
+        @return `true` if the entity is removed
+        """
+        if self._entities.get(entity.id) is not entity:
+            self.log(f'Entity {entity.name!r} is not on the map', 'warn')
+            return False
+        entity.fire('removed')
+        self._remove_entity(entity)
+        self.log('Entity %r is removed', 'debug', entity.name, subsystem='entity')
+        return True
+
+    def entities_at(self, x: int, y: int) -> list:
+        """ Get all entities on a tile """
+        return list(self._spatial.get((x, y), ()))
+
+    def find_entity(self, name: str = None) -> list:
+        """ Find the entities with the given name, or all entities if the name is not given """
+        return [entity for entity in self._entities.values() if name is None or entity.name == name]
+
     ### ------ MAP FUNCTIONALITIES ------ ###
 
     def add_layer(self, name: str, renderer: Callable, switch = False, force_update = False) -> None:
@@ -299,10 +660,11 @@ class Engine(BaseObject):
             self.log(f'layer {name!r} already exist. Renderer overridden.', 'warn')
         
         self._layer_renderer[name] = renderer
-        self.log(f'layer {name!r} is added with renderer {renderer.__name__!r}')
+        self.log(f'layer {name!r} is added with renderer {callable_name(renderer)!r}')
         if switch or force_update:
             self.layer = name
             self.renderer = renderer
+            self._invalidate_renderer()
         if force_update:
             self.renderer(self)
         return
@@ -321,7 +683,8 @@ class Engine(BaseObject):
         
         self.layer = name
         self.renderer = self._layer_renderer[name]
-        self.log(f'switch to layer {self.layer!r} with renderer {self.renderer.__name__!r}')
+        self._invalidate_renderer()
+        self.log(f'switch to layer {self.layer!r} with renderer {callable_name(self.renderer)!r}')
 
         self._pause_event_once = pause_event_check
         if force_update:
@@ -332,24 +695,56 @@ class Engine(BaseObject):
         """ The default renderer.  
         If your renderer somehow is broken, try to set Engine.renderer back to this.
         """
-        print()
-        print(f'time: {self._timestamp:3}')
-        print('.', '-' * self.width * self.pixel_width, '.', sep='')
-        for i in range(self.height):
-            print('|', end='')
-            for j in range(self.width):
-                symbol = self._get_tile(i, j)
-                print(symbol, end='')
-            print('|')
-        print('\'', '-' * self.width * self.pixel_width, '\'', sep='')
+        x0, y0, x1, y1 = self.viewport()
+        border = '-' * (y1 - y0) * self.pixel_width
+        lines = ['', f'time: {self._timestamp:3}', f'.{border}.']
+        lines.extend(f'|{row}|' for row in self._get_frame(x0, y0, x1, y1))
+        lines.append(f"'{border}'")
+        print('\n'.join(lines))
         return
 
-    def update_map(self, items) -> bool:
-        """ [ NOT IMPLEMENTED ] Update a selection of tiles at once """
-        # [ TODO ]
-        raise NotImplementedError
+    def viewport(self) -> Tuple[int,int,int,int]:
+        """ Get the part of the map to draw in this frame. If there is a camera, it is moved after the character.
+        If there is a field of view, what the character sees is updated, so `_get_tile` only draws the visible tiles.
+        Custom renderers can call this once per frame and draw the tiles inside with `_get_tile`, like the default one.
+        @return (x0, y0, x1, y1). Tiles from (x0, y0) to (x1, y1), excluding (x1, y1), are drawn.
+        """
+        if self.fov is not None: self.fov.update(self)
+        if self.camera is None: return 0, 0, self.height, self.width
+        return self.camera.update(self)
+
+    def update_map(self, changes: list) -> list:
+        """ Apply a batch of changes to the map at once.
+        Every change is a tuple starting with its action:
+          ('add', name, x, y, symbol[, props]) - add an item. `props` may set `block`, `hidden`, `life` and `z`.
+                                                 Like `add_item`, an item with `z` is stacked on the tile.
+          ('remove', x, y[, name])             - remove the items on (x, y), optionally only the ones with the given name.
+          ('move', item, x, y)                 - move an item to another tile.
+          ('set', item, props)                 - change the `symbol`, `block` or `hidden` of an item.
+        All changes are validated before any of them is applied. If one of them is invalid, the map is untouched.
+        Changes are applied in order. Items that are removed or replaced, even by a later change in the batch,
+        fire their `removed` events afterwards in the same order, and then the `update_map` event is fired once.
+        Changes that refer to an item removed earlier in the same batch are skipped.
+        @return the created items in the order of the `add` changes, or `None` if the batch is rejected.
+        """
+        if not self._validate_changes(changes): return None
+
+        created, removed = [], []
+        gc_enabled = gc.isenabled()
+        gc.disable() # nothing to collect while allocating the new items
+        try:
+            self._apply_changes(changes, created, removed)
+        finally:
+            if gc_enabled: gc.enable()
 
-    def add_item(self, name: str, x: int, y: int, symbol: str, block: bool = False, hidden: bool = False, life: int = None) -> Item:
+        for item in removed:
+            item.fire('removed')
+        self.log(f'map updated: {len(created)} added, {len(removed)} removed, {len(changes)} changes in total')
+        self.fire('update_map')
+        return created
+
+    def add_item(self, name: str, x: int, y: int, symbol: str, block: bool = False, hidden: bool = False, life: int = None,
+                 z: int = None) -> Item:
         """ Add an item (tile) on to the map.
         @param name - the name of this item. 
                       Can be used to remove certain type of tiles on the map.
@@ -361,6 +756,11 @@ class Engine(BaseObject):
                         Note that all events are still triggered even if the item is hidden.
         @param life - how long will this item exists. 
                       Once its life ends, the item will be removed automatically.
+        @param z - z-order of the item, e.g. 0 for the terrain, 1 for loot and 2 for effects.
+                   If it's given, the item is stacked with the items already on the tile, rather than replacing them.
+                   The topmost visible item is drawn, and the tile blocks if any item on it blocks.
+                   Items with the same z-order are stacked in the order they are put on the tile.
+                   By default, the items on the tile are replaced.
         @return created `Item` object
         """
         if pixel_width(symbol) > self.pixel_width:
@@ -370,21 +770,50 @@ class Engine(BaseObject):
             self.log('Symbol is automatically transformed into space', 'warn')
             symbol = ' '
 
-        new_item = Item(name, x, y, self._timestamp, symbol, life, block, hidden, debug=self.debug, parent=self)
+        new_item = Item(name, x, y, self._timestamp, symbol, life, block, hidden, z, debug=self.debug, parent=self)
+        new_item.tile = padded(symbol, self.pixel_width)
 
-        if self.map[x][y] is not None:
+        if z is None and self.map[x][y] is not None:
             self.log(f'Original item on ({x}, {y}) is replaced', 'warn')
             self._clean_tile(x, y)
-        self.map[x][y] = new_item
-        self.log(f'Item {name!r} is added to ({x}, {y})')
+        self._place(new_item)
+        self.log('Item %r is added to (%d, %d)', 'debug', name, x, y)
 
         return new_item
+
+    def move_item(self, item: Item, x: int, y: int) -> bool:
+        """ Move an existing item to another tile.
+        If the target tile is occupied, the original items on it will be replaced, 
+        unless the item has a z-order, in which case it's stacked with them.
+        @param item - the item to move. It should be created by `add_item`.
+        @param x - new x position of the item
+        @param y - new y position of the item
+        @return `true` if the item is moved.
+        """
+        if item not in self._items:
+            self.log(f'Item {item.name!r} is not on the map. Item not moved', 'warn')
+            return False
+        if (item.x, item.y) == (x, y):
+            return True
+
+        if item.z is None and self.map[x][y] is not None:
+            self.log(f'Original item on ({x}, {y}) is replaced', 'warn')
+            self._clean_tile(x, y)
+        self._touch_tile(item.x, item.y)
+        self._touch_tile(x, y)
+        self._take(item)
+        self.log('Item %r is moved from (%d, %d) to (%d, %d)', 'debug', item.name, item.x, item.y, x, y)
+        if self._tile_watchers: self._on_tile_update(item.x, item.y)
+        item.x, item.y = x, y
+        self._put(item)
+        if self._tile_watchers: self._on_tile_update(x, y)
+        return True
     
     def remove_item(self, x: int = None, y: int = None, name: str = None) -> bool:
         """ Remove an existing item on the map.
         If only the name is specified, all items with the given name will be removed.
-        If only the x and y are specified, the item on the given position will b removed.
-        If all x, y, and name are specified, the item will only be removed if it is on (x, y) and has the same name.
+        If only the x and y are specified, the items on the given position will b removed.
+        If all x, y, and name are specified, only the items on (x, y) with the same name will be removed.
         @return `true` if an item is removed.
         """
         if hasnone([x, y]) and not allnone([x, y]):
@@ -400,34 +829,62 @@ class Engine(BaseObject):
             if not self.map[x][y]:
                 self.log(f'item on ({x}, {y}) not found')
                 return False
-            if self.map[x][y].name == name: 
-                return self._clean_tile(x, y)
+            if self._clean_tile(x, y, name): 
+                return True
             self.log(f'item on ({x}, {y}) is not {name!r}')
             return False
         
         flag = False
-        for rid, cid, item in self._get_items():
-            if item.name == name:
-                flag = self._clean_tile(rid, cid) or flag
+        for item in self._items.find(name=name):
+            if item not in self._items: continue # removed by an earlier callback
+            flag = self._remove(item) or flag
         return flag
     
+    def find_blocking(self, x0: int, y0: int, x1: int, y1: int) -> list:
+        """ Find all blocking tiles in the rectangle from (x0, y0) to (x1, y1), excluding (x1, y1).
+        @return - a list of (x, y)
+        """
+        x0, y0 = max(x0, 0), max(y0, 0)
+        x1, y1 = min(x1, self.height), min(y1, self.width)
+        if isinstance(self.map, ArrayMap):
+            return self.map.blocking(x0, y0, x1, y1)
+        if (x1 - x0) * (y1 - y0) > len(self._items):
+            return sorted({(item.x, item.y) for item in self._items.find(block=True)
+                           if x0 <= item.x < x1 and y0 <= item.y < y1})
+        return [(x, y) for x in range(x0, x1) for y in range(y0, y1) 
+                if self.map[x][y] and self.map[x][y].block]
+
     def find_item(self, name: str = None, symbol: str = None, hidden: bool = None, block: bool = None) -> list:
         """ Find existing items that matches all given properties.  
         Available properties: name, symbol, hidden, block.
         @return - a list of matched items
         """
-        result = []
-        for _, _, item in self._get_items():
-            if name is not None and item.name != name:
-                continue
-            if symbol is not None and item.symbol != symbol:
-                continue
-            if hidden is not None and item.hidden != hidden:
-                continue
-            if block is not None and item.block != block:
-                continue
-            result.append(item)
-        return result
+        return self._items.find(name=name, symbol=symbol, hidden=hidden, block=block)
+
+    def items_at(self, x: int, y: int) -> list:
+        """ Get all items on a tile, from the bottom to the top of its stack """
+        return self._items_at(x, y)
+
+    ### ------ PATHFINDING ------ ###
+
+    def find_path(self, x0: int, y0: int, x1: int, y1: int) -> list:
+        """ Find a shortest route from (x0, y0) to (x1, y1) around blocking items, moving up, down, left or right.
+        Routes are cached, and a cached route is only searched again after the blocking items around it change.
+        See `pathfinding.Pathfinder`.
+        @return the tiles to walk through, excluding (x0, y0) and including (x1, y1), or `None` if it can not be reached
+        """
+        return self._paths().find_path((x0, y0), (x1, y1))
+
+    def distance_field(self, sources: list, max_distance: int = None) -> DistanceField:
+        """ Get the distance from every tile to the nearest of the sources, e.g. `[game.character]` to chase the character.
+        The field is also a flow field, so every entity can take its next step with `field.direction(x, y)` in O(1).
+        Fields are cached. Changes of blocking items are fixed around the changed tiles the next time it's called,
+        so call it again every step rather than keeping the field.
+        @param sources - a list of (x, y)
+        @param max_distance - only search this many steps away from the sources
+        @return a `pathfinding.DistanceField`
+        """
+        return self._paths().distance_field(sources, max_distance)
 
     ### ------ EVENT FUNCTIONALITIES ------ ###
 
@@ -439,11 +896,28 @@ class Engine(BaseObject):
             self.log(f'event {event!r} not exist. Event not fired', 'warn')
             return False
 
-        self.log(f'event {event!r} is fired')
-        for cb in self._subscription[event]:
-            cb(self)
+        if self._deferred is not None and event not in self.LIFECYCLE_EVENT:
+            self._deferred.append(event)
+            self.log('event %r is deferred', 'debug', event)
+            return True
+
+        self.log('event %r is fired', 'debug', event)
+        self._subscription.dispatch(event, self._call)
         return True
 
+    def defer_events(self, flag: bool = True) -> None:
+        """ Queue up the events fired by `fire` and dispatch them together before `step_end`, rather than right away.
+        Events fired while the queue is dispatched are dispatched at the end of the next step,
+        so a storm of events that fire each other can not stall a step.
+        `onstart`, `step_end` and `onend` are always dispatched right away.
+        @param flag - `false` to stop deferring. Events still in the queue are dispatched at once.
+        """
+        if flag:
+            if self._deferred is None: self._deferred = []
+            return
+        self._flush_events()
+        self._deferred = None
+
     def add_event(self, name: str) -> bool:
         """ Register a new event onto the engine. 
         After adding the event, you can now subcribe to your custom event through `subscribe` function.
@@ -453,23 +927,27 @@ class Engine(BaseObject):
             self.log(f'event {name!r} already existed. event not added.', 'warn')
             return False
         
-        self._subscription[name] = []
+        self._subscription.add(name)
         self.log(f'event {name!r} is added')
         return True
     
-    def subscribe(self, event: str, callback: Callable) -> bool:
+    def subscribe(self, event: str, callback: Callable, priority: int = 0, once: bool = False) -> Subscription:
         """ Subscribe a callback to an event on this item. 
         The callback will be triggered once the event is fired.
-        @return whether the callback is successfully subscribed.
+        @param priority - callbacks with higher priority are called first. Callbacks with the same priority 
+                          are called in the order they are subscribed.
+        @param once - whether to unsubscribe the callback once it's called
+        @return a `Subscription` handle, which can `cancel` the subscription in O(1), e.g. for lambdas,
+                or `False` if the callback is not subscribed.
         """
         if event not in self._subscription:
             self.log(f'Event {event!r} not exists. Callback not subscribed', 'warn')
-            self.log(f'Available events: {list(self._subscription.keys())}', 'warn')
+            self.log(f'Available events: {list(self._subscription)}', 'warn')
             return False
     
-        self._subscription[event].append(callback)
-        self.log(f'callback {callback.__name__!r} is subscribed to event {event!r}')
-        return True
+        subscription = self._subscription.subscribe(event, callback, priority, once)
+        self.log(f'callback {callable_name(callback)!r} is subscribed to event {event!r}')
+        return subscription
 
     def unsubscribe(self, event: str, callback: Callable) -> bool:
         """ Unsubscribe a certain function from the given event.
@@ -479,21 +957,24 @@ class Engine(BaseObject):
         if event not in self._subscription:
             self.log(f'event {event!r} not found', 'warn')
             return False
-        if callback not in self._subscription[event]:
-            self.log(f'callback {callback.__name__!r} not found', 'warn')
+        subscription = self._subscription.find(event, callback)
+        if subscription is None:
+            self.log(f'callback {callable_name(callback)!r} not found', 'warn')
             return False
 
-        self._subscription[event].remove(callback)
-        self.log(f'callback {callback.__name__!r} is unsubscribed from the event {event!r}')
+        subscription.cancel()
+        self.log(f'callback {callable_name(callback)!r} is unsubscribed from the event {event!r}')
         return True
 
-    def subscribe_keyboard(self, key: str, event: str, callback: Callable) -> bool:
+    def subscribe_keyboard(self, key: str, event: str, callback: Callable, priority: int = 0, once: bool = False) -> Subscription:
         """ Subscribe to a certain keyboard event.  
         If stdin is used, the event will be subscribed to the exact string input ('esc' string, rather than `Esc` key);  
         or if pynput is used, the event will be bound to a single keypress (`Esc` key).  
         The key name of special keys be the same as pynput keycode if pynput is used: 
           https://pynput.readthedocs.io/en/stable/keyboard.html?highlight=key#pynput.keyboard.Key
-        @return `true` if the callback is successfully subscribed.
+        @param priority - callbacks with higher priority are called first
+        @param once - whether to unsubscribe the callback once it's called
+        @return a `Subscription` handle, or `False` if the callback is not subscribed.
         """
         if self.input == 'stdin': # only press is available for stdin
             event = 'press'
@@ -507,9 +988,9 @@ class Engine(BaseObject):
             self.log(f'Available actions: {self.KB_EVENT}', 'warn')
             return False
 
-        self._kb_callback[event][key].append(callback)
+        subscription = self._kb_callback[event].subscribe(key, callback, priority, once)
         self.log(f'{event!r} event with key {str(key)!r} subscribed')
-        return True
+        return subscription
 
     def unsubscribe_keyboard(self, key: str, event: str, callback: Callable) -> bool:
         """ Unsubscribe a certain callback from the event of the given key .
@@ -526,21 +1007,23 @@ class Engine(BaseObject):
         if event not in self.KB_EVENT: 
             self.log(f'action {event!r} not found', 'warn')
             return False
-        if callback not in self._kb_callback[event][key]:
-            self.log(f'callback {callback.__name__!r} not found', 'warn')
+        subscription = self._kb_callback[event].find(key, callback)
+        if subscription is None:
+            self.log(f'callback {callable_name(callback)!r} not found', 'warn')
             return False
         
-        self._kb_callback[event][key].remove(callback) # stdin
+        subscription.cancel()
         self.log(f'{event!r} event with key {str(key)!r} unsubscribed')
         return True
 
-    def timer(self, time: int, callback: Callable) -> int:
+    def timer(self, time: int, callback: Callable = None) -> int:
         """ Set up a timer. The callback will be triggered once the time is out.
         @return an timer id, which can be used to cancel the timer.
+                In `run`, it can also be awaited until the timer is fired, e.g. `await game.timer(3)`.
         """
-        id = random.randint(1000, 10000)
+        id = TimerId(self._scheduler.schedule(self._due(time), self._timeout), self)
         self._timer[id] = [time, callback]
-        self.log(f'timer {id} is added')
+        self.log('timer %d is added', 'debug', id, subsystem='timer')
         return id
 
     def remove_timer(self, id: int) -> bool:
@@ -551,22 +1034,84 @@ class Engine(BaseObject):
             self.log(f'timer {id} not found', 'warn')
             return False
         del self._timer[id]
-        self.log(f'timer {id} is removed')
+        self._cancel_timer(id)
+        self.log('timer %d is removed', 'debug', id, subsystem='timer')
         return True
     
+    ### ------ PERSISTENCE ------ ###
+
+    def save(self, path: str, handlers = None) -> None:
+        """ Save the state of the game into a file, see `snapshot` for the format.
+        The map, items, character position, timestamp, backpack, current layer and pending timers are saved.
+        Callbacks are saved by name, so only those in `handlers` are kept. Lambdas and bound methods have to be registered too.
+        @param handlers - a `snapshot.HandlerRegistry` of named callbacks, timer callbacks and layer renderers
+        """
+        from . import snapshot
+        snapshot.save(self, path, handlers)
+
+    @classmethod
+    def load(cls, path: str, move_function: Callable, handlers = None, **kwargs) -> 'Engine':
+        """ Create a game from a file written by `save`. The file is memory-mapped, so large maps load quickly.
+        Pending timers get new ids after loading.
+        @param move_function - the movement controller, see `__init__`
+        @param handlers - a `snapshot.HandlerRegistry` to bind the saved callbacks by their names
+        @param kwargs - other arguments of `__init__`, e.g. `input`, `map_renderer` or `map_storage`
+        @return the loaded `Engine`
+        """
+        from . import snapshot
+        return snapshot.load(path, move_function, handlers, **kwargs)
+
+    def record(self, checkpoint_every: int = 100, handlers = None):
+        """ Start recording the game, so that the session can be replayed, jumped to any timestamp or stepped backward.
+        The events from the input source, the seed of `Engine.random`, a snapshot every `checkpoint_every` steps
+        and the tiles changed by every step are recorded. See `replay.Recording`.
+        @param handlers - a `snapshot.HandlerRegistry` to save the callbacks in the snapshots by name
+        @return the `replay.Recording`
+        """
+        from .replay import Recording
+        if self._recorder is not None:
+            self.log('the game is already being recorded', 'warn')
+            return self._recorder
+        self._recorder = Recording(self, checkpoint_every, handlers)
+        self.log(f'recording started at {self._timestamp}, checkpoint every {checkpoint_every} steps')
+        return self._recorder
+
+    def stop_recording(self):
+        """ Stop recording the game.
+        @return the `replay.Recording`, or `None` if the game is not being recorded
+        """
+        recorder, self._recorder = self._recorder, None
+        return recorder
+
     ### ------ UTILITIES ------ ###
 
     def _next(self) -> int:
         """ Called when a step ends """
         self._timestamp += 1
+        prof = self._profiler or NULL_PROFILER
+        start = time.perf_counter()
+        if self._stepping:
+            self._step_entities()
+            start = prof.lap('entities', start)
         self._check_event()
+        start = prof.lap('check_event', start)
         self._tik_timer()
+        start = prof.lap('tik_timer', start)
+        if self._deferred:
+            self._flush_events()
+            start = prof.lap('deferred_events', start)
         self.fire('step_end')
+        prof.lap('step_end', start)
+        if self._recorder is not None: self._recorder._end_step(self)
+        if isinstance(self.map, ChunkMap): self.map.update(*self.character)
+        prof.end_step({'items': len(self._items), 'timers': len(self._scheduler), 'entities': len(self._entities)})
         return self._timestamp
     
     def _cleanup(self) -> bool:
         """ Called after the game ends """
-        ## anything to do?
+        if self.input_source: self.input_source.close()
+        if isinstance(self.map, ChunkMap): self.map.close()
+        self.logger.sink.flush()
         return True
     
     def _listen(self) -> bool:
@@ -574,20 +1119,158 @@ class Engine(BaseObject):
         Listen to user action and map events to corresponding handlers.
         @return `True` if a valid event is detected.
         """
-        updated = None
-        if self.input == 'pynput':
-            with keyboard.Events() as events:
-                event = events.get()
-                self.log(f'Received event {str(event)!r} (pynput)')
-                updated = self._handle_keyboard(event)
-        elif self.input == 'stdin':
-            event = input('input: ').lower()
-            self.log(f'Received input {event!r} (stdin)')
-            updated = self._handle_stdin(event)
-        else:
+        if not self._input_supported():
             self.log(f'Selected input system {self.input!r} not supported.', 'error')
             self.end()
-        return updated
+            return True
+
+        return self._dispatch(self.input_source.read(self))
+
+    def _input_supported(self) -> bool:
+        return self.input_source is not None and self.input in ('stdin', 'pynput')
+
+    def _dispatch(self, event) -> bool:
+        """ Handle an event from the input source. `None` means the source has run out of events.
+        @return `True` if the event is valid.
+        """
+        if self._recorder is not None: self._recorder._input(self, event)
+        if event is None:
+            self.log('Input source has no more events', subsystem='input')
+            self.end()
+            return True
+        self.log('Received event %r (%s)', 'debug', str(event), self.input, subsystem='input')
+        if self.input == 'pynput':
+            return self._handle_keyboard(event)
+        return self._handle_stdin(event)
+
+    def _realtime_loop(self, render: bool, tick_rate: float, max_fps: float) -> int:
+        """ The game loop of the real-time mode. See `start`. """
+        period, frame_period = 1 / tick_rate, 1 / max_fps
+        self.input_source.start(self)
+        self.fire('onstart')
+        scheduled = time.perf_counter()
+        last_frame = scheduled - frame_period # the first frame is drawn right away
+        while not self.isend:
+            yield self._timestamp
+
+            # YOUR CODE IN THE LOOP WILL BE PUT RIGHT HERE
+
+            now = time.perf_counter()
+            if render and now - last_frame >= frame_period * 0.999:
+                self._render()
+                self._frame_count += 1
+                last_frame = now
+            start = time.perf_counter()
+            for event in self._coalesce(self.input_source.poll()):
+                self._dispatch(event)
+                if self.isend: break
+            if self._profiler: self._profiler.lap('listen', start)
+            self._next()
+
+            scheduled, delay = self._tick_delay(scheduled, period)
+            if delay: time.sleep(delay)
+            self._record_tick(scheduled)
+        yield None
+
+    def _tick_delay(self, scheduled: float, period: float) -> Tuple[float, float]:
+        """ Schedule the next real-time tick.
+        @return when the next tick is scheduled, and how long to wait for it
+        """
+        scheduled += period
+        delay = scheduled - time.perf_counter()
+        if delay < -period: # too far behind, skip the missed ticks
+            return time.perf_counter(), 0
+        return scheduled, max(delay, 0)
+
+    def _record_tick(self, scheduled: float) -> None:
+        """ Record the lateness of a real-time tick """
+        self._tick_count += 1
+        self._tick_lateness.append(max(time.perf_counter() - scheduled, 0))
+
+    async def _render_task(self, max_fps: float) -> None:
+        """ Render the map periodically. Used by the real-time mode of `run`. """
+        while not self.isend:
+            self._render()
+            self._frame_count += 1
+            await asyncio.sleep(1 / max_fps)
+
+    async def _alisten(self) -> bool:
+        """ The asyncio version of `_listen`. Blocking sources are read in a worker thread. """
+        if not self._input_supported(): return self._listen()
+        if self.input_source.blocking:
+            event = await self._loop.run_in_executor(None, self.input_source.read, self)
+        else:
+            event = self.input_source.read(self)
+        return self._dispatch(event)
+
+    def _render(self) -> None:
+        """ Render current layer """
+        if self._profiler is None: return self.renderer(self)
+        start = time.perf_counter()
+        self.renderer(self)
+        self._profiler.lap('render', start)
+
+    def _flush_events(self) -> None:
+        """ Dispatch the events queued up by `defer_events`. Events fired meanwhile wait for the next flush. """
+        events, self._deferred = self._deferred, []
+        for event in events or ():
+            self.log('event %r is fired', 'debug', event)
+            self._subscription.dispatch(event, self._call)
+
+    def _call(self, callback: Callable):
+        """ Call a callback subscribed to an event of the engine """
+        return self._invoke(callback, self)
+
+    def _invoke(self, callback: Callable, *args):
+        """ Call a callback. If it returns an awaitable, e.g. it is a coroutine function, the awaitable is run as a task. """
+        if self._profiler is None: result = callback(*args)
+        else:                      result = self._profiler.call(callback, args)
+        if result is not None and inspect.isawaitable(result):
+            self._spawn(result)
+        return result
+
+    def _spawn(self, awaitable) -> None:
+        """ Run an awaitable as a task of the running event loop, or right away if there is no loop. """
+        loop = self._loop
+        if loop is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                asyncio.run(self._guard(awaitable))
+                return
+        task = loop.create_task(self._guard(awaitable))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _guard(self, awaitable):
+        """ Await a callback task and log its failure, since there is no caller to raise to """
+        try:
+            return await awaitable
+        except Exception as e:
+            self.log(f'callback task failed: {e!r}', 'error')
+
+    def _coalesce(self, events: list) -> list:
+        """ Merge the events received during a tick. 
+        Only the last movement is kept, and repeated events (e.g. a held key) are handled once.
+        """
+        result, seen, move = [], set(), None
+        for event in events:
+            if event is None:
+                result.append(None)
+                break
+            if self.input == 'pynput':
+                key = (type(event).__name__, event.key)
+                ismove = key[0] == 'Press' and event.key in self.CONTROL_KEY
+            else:
+                key = event
+                ismove = event in self.CONTROL_KEY
+            if ismove:
+                move = event
+            elif key not in seen:
+                seen.add(key)
+                result.append(event)
+        if move is not None: result.insert(len(result) - (result[-1:] == [None]), move)
+        return result
 
     def _handle_stdin(self, key: str) -> bool:
         """ Handle events from standard input """
@@ -596,8 +1279,7 @@ class Engine(BaseObject):
             self.move(self.CONTROL_KEY[key])
             flag = True
 
-        for cb in self._kb_callback['press'][key]:
-            cb(self)
+        if self._kb_callback['press'].dispatch(key, self._call):
             flag = True
         return flag
 
@@ -609,78 +1291,511 @@ class Engine(BaseObject):
         if self.layer == 'map' and action == 'press' and event.key in self.CONTROL_KEY:
             self.move(self.CONTROL_KEY[event.key])
             flag = True
-        for cb in self._kb_callback[action][event.key]:
-            cb(self)
+        if self._kb_callback[action].dispatch(event.key, self._call):
             flag = True
         return flag
     
     def _check_event(self) -> None:
-        """ Check global events, including timers, item events, etc. """
+        """ Check the `enter` and `leave` events of items.
+        Only the items on the tile the character occupied at the last check
+        and the items on its current tile are visited.
+        """
         if self.layer != 'map': return
         if self._pause_event_once:
             self._pause_event_once = False
             return
         
-        for rid, cid, item in self._get_items():
-            if rid == self.character[0] and cid == self.character[1]:
-                item.fire('enter')
-            elif item.istouched:
+        current = self._items_at(*self.character)
+        for item in self._touched:
+            if item.istouched and item in self._items and item not in current:
                 item.fire('leave')
-            
-            alive = item._check_alive(self._timestamp)
-            if not alive:
-                self._clean_tile(rid, cid)
+        for item in current:
+            if item in self._items: item.fire('enter')
+        self._touched = current
     
     def _tik_timer(self) -> None:
-        """ Check existing timers """
-        # [TODO-REFACT]
-        dead = []
-        for id, obj in self._timer.items():
-            obj[0] -= 1
-            self.log(f'timer {id} remain time: {obj[0]}')
-            if obj[0] <= 0:
-                obj[1](self)
-                dead.append(id)
-        for id in dead:
-            self.remove_timer(id)
+        """ Fire the engine timers, item timers and item lifetimes that are due """
+        for id, callback, args in self._scheduler.pop_due(self._timestamp):
+            callback(id, *args)
+            if id in self._waiters:
+                for future in self._waiters.pop(id):
+                    if not future.done(): future.set_result(self._timestamp)
         return
+
+    def _cancel_timer(self, id: int) -> None:
+        """ Cancel a pending timer, as well as everyone awaiting it """
+        self._scheduler.cancel(id)
+        for future in self._waiters.pop(id, ()):
+            future.cancel()
+
+    def _wait_timer(self, id: int):
+        """ Create a future that is resolved with the timestamp once the timer is fired """
+        future = asyncio.get_running_loop().create_future()
+        if id in self._scheduler: self._waiters.setdefault(id, []).append(future)
+        else:                     future.set_result(self._timestamp) # already fired or cancelled
+        return future
+
+    def _due(self, time: int) -> int:
+        """ Get the timestamp at which a timer set up now with the given time is fired """
+        return self._timestamp + max(time, 1)
+
+    def _timeout(self, id: int) -> None:
+        """ Called by the scheduler once an engine timer is due """
+        _, callback = self._timer.pop(id)
+        self.log('timer %d is fired', 'debug', id, subsystem='timer')
+        if callback: self._invoke(callback, self)
+
+    def _restore_timer(self, due: int, callback: Callable) -> int:
+        """ Set up a timer that is fired at the given timestamp. Used when loading a snapshot. """
+        id = TimerId(self._scheduler.schedule(due, self._timeout), self)
+        self._timer[id] = [due - self._timestamp, callback]
+        return id
+
+    def _restore_life_timer(self, item: Item) -> None:
+        """ Schedule the life expiry of a loaded item """
+        self._life_timer[item] = self._scheduler.schedule(item.created + item.life + 1, self._expire, item)
+
+    def _expire(self, id: int, item: Item) -> None:
+        """ Called by the scheduler once the life of an item ends """
+        del self._life_timer[item]
+        self._touch_tile(item.x, item.y)
+        item.hidden = True
+        self._on_item_update(item)
+        self._remove(item)
     
+    def _invalidate_renderer(self) -> None:
+        """ Ask the current renderer to repaint the whole frame next time, if it supports partial redraw """
+        invalidate = getattr(self.renderer, 'invalidate', None)
+        if invalidate: invalidate()
+
     def _get_tile(self, x: int, y: int) -> str:
-        """ Get the tile symbol of a certain position """
-        item = self.map[x][y]
+        """ Get the tile symbol of a certain position, padded to the pixel width """
         if x == self.character[0] and y == self.character[1]:
-            symbol = self.character_char
-        elif item and not item.hidden:
-            symbol = item.symbol
-        else:
-            symbol = self.map_filler
-        
-        symbol_width = pixel_width(symbol)
-        width = self.pixel_width - symbol_width + 1
-        # print(x, y, width)
-        return f'{symbol:>{width}}'
+            return padded(self.character_char, self.pixel_width)
+        fov = self.fov
+        if fov is not None and (x, y) not in fov.visible:
+            if (x, y) not in fov.explored: return padded(self.map_filler, self.pixel_width)
+            item = self.map[x][y] # only the items of explored tiles are remembered
+            return item.tile if item and not item.hidden else padded(self.map_filler, self.pixel_width)
+        if self._spatial:
+            entities = self._spatial.get((x, y))
+            if entities:
+                for entity in reversed(list(entities)):
+                    if not entity.hidden: return entity.tile
+        item = self.map[x][y]
+        if item and not item.hidden:
+            return item.tile
+        return padded(self.map_filler, self.pixel_width)
     
+    def _items_at(self, x: int, y: int) -> list:
+        """ Get all items on a certain position """
+        if not self._in_map(x, y): return []
+        item = self.map[x][y]
+        if item is None: return []
+        return list(item.items) if type(item) is ItemStack else [item]
+
+    def _get_frame(self, x0: int = 0, y0: int = 0, x1: int = None, y1: int = None) -> list:
+        """ Get every row of the map, or of the rectangle from (x0, y0) to (x1, y1), as a string of tiles """
+        x1 = self.height if x1 is None else x1
+        y1 = self.width if y1 is None else y1
+        if isinstance(self.map, ArrayMap):
+            fov = self.fov
+            overlay = {(entity.x, entity.y): entity.tile for entity in self._entities.values() 
+                       if not entity.hidden and (fov is None or (entity.x, entity.y) in fov.visible)}
+            overlay[tuple(self.character)] = padded(self.character_char, self.pixel_width)
+            mask = None if fov is None else fov.visible | fov.explored if fov.explored else fov.visible
+            return self.map.frame(lambda symbol: padded(symbol, self.pixel_width), 
+                                  padded(self.map_filler, self.pixel_width), overlay, (x0, y0, x1, y1), mask)
+        if self.fov is not None:
+            # only the visible and explored tiles are looked up
+            filler = padded(self.map_filler, self.pixel_width)
+            rows = [[filler] * (y1 - y0) for _ in range(x0, x1)]
+            for tiles in (self.fov.explored, self.fov.visible, [tuple(self.character)]):
+                for x, y in tiles:
+                    if x0 <= x < x1 and y0 <= y < y1: rows[x - x0][y - y0] = self._get_tile(x, y)
+            return [''.join(row) for row in rows]
+        return [''.join([self._get_tile(i, j) for j in range(y0, y1)]) for i in range(x0, x1)]
+
     def _get_items(self) -> Tuple[int,int,Item]:
         """
-        Yield all existing items.
+        Yield all existing items, in the order they were added.
+        It is safe to remove items while iterating.
         @return (x, y, item)
         """
-        for rid, row in enumerate(self.map):
-            for cid, item in enumerate(row):
-                if item: yield rid, cid, item
+        for item in list(self._items):
+            yield item.x, item.y, item
     
-    def _clean_tile(self, x: int, y: int) -> bool:
+    def _touch_tile(self, x: int, y: int) -> None:
+        """ Called right before the content of a tile is changed """
+        if self._recorder is not None: self._recorder._touch(self, x, y)
+
+    def _paths(self) -> Pathfinder:
+        """ Get the pathfinder, creating it on the first use """
+        if self._pathfinder is None:
+            self._pathfinder = Pathfinder(self)
+            self._tile_watchers.append(self._pathfinder)
+        return self._pathfinder
+
+    def _on_tile_update(self, x: int, y: int) -> None:
+        """ Called after the content of a tile is changed """
+        for watcher in self._tile_watchers:
+            watcher._update(x, y)
+
+    def _step_entities(self) -> None:
+        """ Move every entity with a policy """
+        for entity in list(self._stepping):
+            if entity.parent is not self: continue # removed by an earlier entity
+            action = entity.policy(entity)
+            if action is not None:
+                x, y = entity.move_cb(action, entity.x, entity.y)
+                self._move_entity(entity, x, y)
+
+    def _move_entity(self, entity: Entity, x: int, y: int) -> bool:
+        """ Move an entity to a tile if it's not blocked, and fire the `leave` and `enter` events of the tiles
+        @return `true` if the entity is moved
+        """
+        ex, ey = entity.x, entity.y
+        if x == ex and y == ey: return True
+        if not (0 <= x < self.height and 0 <= y < self.width): return False
+        item = self.map[x][y]
+        if item is not None and item.block:
+            if entity._callback:
+                for blocker in self._items_at(x, y):
+                    if blocker.block: entity.fire('collide', blocker)
+            return False
+        spatial = self._spatial
+        others = spatial.get((x, y))
+        if others:
+            for other in others:
+                if other.block:
+                    if entity._callback: entity.fire('collide', other)
+                    return False
+
+        if self._recorder is not None: self._recorder._touch_entity(self, entity)
+        here = spatial[ex, ey]
+        if len(here) == 1: del spatial[ex, ey]
+        else:              del here[entity]
+        if others is None: spatial[x, y] = {entity: None}
+        else:              others[entity] = None
+        entity.x, entity.y = x, y
+
+        if entity._callback:
+            for left in self._items_at(ex, ey): entity.fire('leave', left)
+            if item is not None:
+                for entered in self._items_at(x, y): entity.fire('enter', entered)
+        return True
+
+    def _on_entity_policy(self, entity: Entity) -> None:
+        """ Called after the policy of an entity is changed """
+        if entity.policy is None: self._stepping.pop(entity, None)
+        else:                     self._stepping[entity] = None
+
+    def _entity_blocking(self, x: int, y: int) -> bool:
+        """ Whether a blocking entity is on the tile """
+        entities = self._spatial.get((x, y))
+        return bool(entities) and any(entity.block for entity in entities)
+
+    def _add_entity(self, entity: Entity) -> None:
+        """ Start tracking an entity """
+        if self._recorder is not None: self._recorder._touch_entity(self, entity)
+        self._entities[entity.id] = entity
+        self._spatial.setdefault((entity.x, entity.y), {})[entity] = None
+        if entity.policy is not None: self._stepping[entity] = None
+
+    def _remove_entity(self, entity: Entity) -> None:
+        """ Stop tracking an entity, without firing any event """
+        if self._recorder is not None: self._recorder._touch_entity(self, entity)
+        del self._entities[entity.id]
+        here = self._spatial[entity.x, entity.y]
+        del here[entity]
+        if not here: del self._spatial[entity.x, entity.y]
+        self._stepping.pop(entity, None)
+        entity.parent = None
+
+    def _on_item_update(self, *items: Item) -> None:
+        """ Called after the properties of items are changed """
+        for item in items:
+            self._items.update(item)
+        if self._stacks:
+            for item in items:
+                stack = self._stacks.get((item.x, item.y))
+                if stack is not None and item in stack:
+                    stack.refresh()
+                    self.map[item.x][item.y] = stack
+        if isinstance(self.map, ArrayMap):
+            self.map.refresh(items)
+        if self._tile_watchers:
+            for item in items: self._on_tile_update(item.x, item.y)
+
+    def _clean_tile(self, x: int, y: int, name: str = None) -> bool:
         """
-        Remove the item on a certain tile
+        Remove the items on a certain tile
+        @param name - only remove the items with this name
         @return `true` if an item is removed
         """
-        item = self.map[x][y]
-        if not item: return False
+        flag = False
+        for item in self._items_at(x, y):
+            if name is not None and item.name != name: continue
+            if item not in self._items: continue # removed by an earlier callback
+            flag = self._remove(item) or flag
+        return flag
+
+    def _remove(self, item: Item) -> bool:
+        """ Remove an item, firing its `removed` event
+        @return `true` if the item is removed
+        """
         item.fire('removed')
-        self.map[x][y] = None
-        self.log(f'Item {item.name!r} on ({x}, {y}) is removed')
+        self._detach(item)
+        self.log('Item %r on (%d, %d) is removed', 'debug', item.name, item.x, item.y)
+        return True
+
+    def _put(self, item: Item) -> None:
+        """ Put an item on its tile, stacking it with the items already there """
+        x, y = item.x, item.y
+        occupant = self.map[x][y]
+        if occupant is None:
+            self.map[x][y] = item
+            return
+        stack = self._stacks.get((x, y))
+        if stack is None: stack = self._stacks[x, y] = ItemStack(x, y, [occupant])
+        stack.add(item)
+        self.map[x][y] = stack
+
+    def _take(self, item: Item) -> bool:
+        """ Take an item off its tile
+        @return `true` if the item was on the tile
+        """
+        x, y = item.x, item.y
+        stack = self._stacks.get((x, y)) if self._stacks else None
+        if stack is None:
+            if self.map[x][y] is not item: return False
+            self.map[x][y] = None
+            return True
+        if not stack.remove(item): return False
+        if len(stack) == 1:
+            del self._stacks[x, y]
+            self.map[x][y] = stack.items[0]
+        else:
+            self.map[x][y] = stack
+        return True
+
+    def _place(self, item: Item, register: bool = True) -> None:
+        """ Put a new item on its tile and start tracking it. It's stacked with the items already on the tile.
+        @param register - whether to add the item into the registry. Set this if the caller registers items in bulk.
+        """
+        if self._recorder is not None: self._recorder._touch(self, item.x, item.y)
+        self._put(item)
+        if register: self._items.add(item)
+        if self._tile_watchers: self._on_tile_update(item.x, item.y)
+        if item.life:
+            # an item is removed once `timestamp > created + life`
+            self._life_timer[item] = self._scheduler.schedule(item.created + item.life + 1, self._expire, item)
+
+    def _restore_items(self, items: list, buckets: dict, stacks: list = ()) -> None:
+        """ Put loaded items back on the map in bulk. Their life timers are restored by `_restore_life_timer`.
+        @param buckets - the order of the registry indexes, see `ItemRegistry.restore`
+        @param stacks - items of the tiles holding more than one item, every stack listed from the bottom to the top
+        """
+        map = self.map
+        for item in items:
+            map[item.x][item.y] = item
+        for stack in stacks:
+            x, y = stack[0].x, stack[0].y
+            map[x][y] = self._stacks[x, y] = ItemStack(x, y, stack)
+        self._items.restore(items, buckets)
+        if isinstance(self.map, ArrayMap):
+            self.map.refresh(items)
+
+    def _unload_items(self, items: list, handlers) -> list:
+        """ Stop tracking the items of a chunk that is dropped by `ChunkMap`, without touching the map or firing any event.
+        @param handlers - a `snapshot.HandlerRegistry` to save the callbacks by name
+        @return the state of the items, to be given to `_reload_items`
+        """
+        rows, skipped = [], 0
+        for item in [item for occupant in items for item in (occupant.items if type(occupant) is ItemStack else (occupant,))]:
+            self._stacks.pop((item.x, item.y), None)
+            events, timers = [], []
+            for event, subscriptions in (item._callback.items() if item._callback else ()):
+                for subscription in subscriptions:
+                    name = handlers.name_of(subscription.callback)
+                    if name is None: skipped += 1
+                    else:            events.append((event, name, subscription.priority, subscription.once))
+            for id, (_, callback) in (item._timer or {}).items():
+                name = handlers.name_of(callback) if callback else None
+                if callback and name is None: skipped += 1
+                else:                         timers.append((self._scheduler.due(id), name))
+            rows.append((item.name, item.x, item.y, item.symbol, item.block, item.hidden, item.life, item.created,
+                         item.z, item.istouched, events, timers))
+            self._items.discard(item)
+            item._cancel_timers()
+            life_timer = self._life_timer.pop(item, None)
+            if life_timer is not None: self._cancel_timer(life_timer)
+        if skipped:
+            self.log(f'{skipped} callbacks of unloaded items are not in the handler registry and are dropped', 'warn')
+        return rows
+
+    def _reload_items(self, rows: list, chunk: dict, handlers) -> None:
+        """ Recreate the items of a chunk loaded by `ChunkMap`, see `_unload_items` """
+        for name, x, y, symbol, block, hidden, life, created, z, istouched, events, timers in rows:
+            item = Item(name, x, y, created, symbol, life, block, hidden, z, debug=self.debug, parent=self)
+            item.tile = padded(symbol, self.pixel_width)
+            occupant = chunk.get((x, y))
+            if occupant is None:
+                chunk[x, y] = item
+            else: # the items of a stack come in order from the bottom
+                stack = self._stacks.get((x, y))
+                if stack is None: stack = chunk[x, y] = self._stacks[x, y] = ItemStack(x, y, [occupant])
+                stack.items.append(item)
+                stack.refresh()
+            self._items.add(item)
+            if block and self._tile_watchers: self._on_tile_update(x, y)
+            if life: self._restore_life_timer(item)
+            for due, handler in timers:
+                callback = handlers.get(handler) if handler is not None else None
+                if callback or handler is None: item._restore_timer(due, callback)
+            for event, handler, priority, once in events:
+                callback = handlers.get(handler)
+                if callback: item.subscribe(event, callback, priority, once)
+            if istouched:
+                item.istouched = True
+                self._touched.append(item) # `leave` is fired by the next check if the character is gone
+        self.log('%d items are reloaded', 'debug', len(rows))
+
+    def _detach(self, item: Item) -> Item:
+        """ Take an item off the map and stop tracking it, without firing any event """
+        occupant = self.map[item.x][item.y]
+        if occupant is item or (type(occupant) is ItemStack and item in occupant): 
+            if self._recorder is not None: self._recorder._touch(self, item.x, item.y)
+            self._take(item)
+            if self._tile_watchers: self._on_tile_update(item.x, item.y)
+        self._items.discard(item)
+        item._cancel_timers()
+        life_timer = self._life_timer.pop(item, None)
+        if life_timer is not None: self._cancel_timer(life_timer)
+        return item
+
+    def _apply_changes(self, changes: list, created: list, removed: list) -> None:
+        """ Apply a validated batch of changes for `update_map` without firing any event.
+        New items are registered in bulk, right before a change that may look them up.
+        """
+        pending = [] # created items that are not registered yet
+        updated = [] # items whose properties are changed
+        def flush():
+            self._items.add_many(pending)
+            pending.clear()
+
+        for change in changes:
+            action = change[0]
+            if action == 'add':
+                name, x, y, symbol = change[1:5]
+                props = change[5] if len(change) > 5 else {}
+                item = Item(name, x, y, self._timestamp, symbol or ' ', props.get('life'), 
+                            props.get('block', False), props.get('hidden', False), props.get('z'), debug=self.debug, parent=self)
+                item.tile = padded(item.symbol, self.pixel_width)
+                if item.z is None and self.map[x][y] is not None:
+                    if pending: flush()
+                    removed.extend(self._detach(occupant) for occupant in self._items_at(x, y))
+                self._place(item, register=False)
+                pending.append(item)
+                created.append(item)
+                continue
+
+            if pending: flush()
+            if action == 'remove':
+                x, y = change[1:3]
+                for item in self._items_at(x, y):
+                    if len(change) < 4 or item.name == change[3]:
+                        removed.append(self._detach(item))
+            elif action == 'move':
+                item, x, y = change[1:4]
+                if item not in self._items or (item.x, item.y) == (x, y): continue
+                if item.z is None and self.map[x][y] is not None: 
+                    removed.extend(self._detach(occupant) for occupant in self._items_at(x, y))
+                self._touch_tile(item.x, item.y)
+                self._touch_tile(x, y)
+                self._take(item)
+                if self._tile_watchers: self._on_tile_update(item.x, item.y)
+                item.x, item.y = x, y
+                self._put(item)
+                if self._tile_watchers: self._on_tile_update(x, y)
+            elif action == 'set':
+                item, props = change[1:3]
+                if item not in self._items: continue
+                self._touch_tile(item.x, item.y)
+                if 'symbol' in props:
+                    item.symbol = props['symbol'] or ' '
+                    item.tile = padded(item.symbol, self.pixel_width)
+                if 'block' in props: item.block = props['block']
+                if 'hidden' in props: item.hidden = props['hidden']
+                updated.append(item)
+        if pending: flush()
+        if updated: self._on_item_update(*updated)
+
+    def _validate_changes(self, changes: list) -> bool:
+        """ Check a batch of changes for `update_map`
+        @return `true` if every change is valid
+        """
+        symbols = set()
+        for i, change in enumerate(changes):
+            action = change[0] if change else None
+            if action == 'add':
+                if not 5 <= len(change) <= 6 or not self._is_tile(*change[2:4]):
+                    self.log(f'change #{i} {change!r} is not a valid `add` change', 'error')
+                    return False
+                if len(change) == 6 and not set(change[5]) <= {'block', 'hidden', 'life', 'z'}:
+                    self.log(f'change #{i}: unknown properties {set(change[5])!r}', 'error')
+                    return False
+                symbols.add(change[4])
+            elif action == 'remove':
+                if not 3 <= len(change) <= 4 or not self._is_tile(*change[1:3]):
+                    self.log(f'change #{i} {change!r} is not a valid `remove` change', 'error')
+                    return False
+            elif action == 'move':
+                if len(change) != 4 or change[1] not in self._items or not self._is_tile(*change[2:4]):
+                    self.log(f'change #{i} {change!r} is not a valid `move` change', 'error')
+                    return False
+            elif action == 'set':
+                if len(change) != 3 or change[1] not in self._items:
+                    self.log(f'change #{i} {change!r} is not a valid `set` change', 'error')
+                    return False
+                if not set(change[2]) <= {'symbol', 'block', 'hidden'}:
+                    self.log(f'change #{i}: unknown properties {set(change[2])!r}', 'error')
+                    return False
+                if 'symbol' in change[2]: symbols.add(change[2]['symbol'])
+            else:
+                self.log(f'change #{i}: action {action!r} not supported', 'error')
+                return False
+            
+        if any(pixel_width(symbol) > self.pixel_width for symbol in symbols):
+            self.log(f"Item symbol is longer than the pixel width of your map. This may cause some problem during the rendering", 'warn')
+        if '' in symbols:
+            self.log('Symbol is automatically transformed into space', 'warn')
         return True
+
+    def _in_map(self, x: int, y: int) -> bool:
+        """ Whether the position is inside the map """
+        return 0 <= x < self.height and 0 <= y < self.width
+
+    def _is_tile(self, x, y) -> bool:
+        """ Whether the position is a pair of integers inside the map """
+        return isinstance(x, int) and isinstance(y, int) and self._in_map(x, y)
     
+    def _create_map(self, storage: str):
+        """ Create the map storage """
+        if isinstance(storage, ChunkMap):
+            return storage.bind(self)
+        if storage == 'numpy' and not NUMPY_AVAILABLE:
+            self.log('numpy is not installed. Fall back to list map storage', 'warn')
+            storage = 'list'
+        if storage == 'numpy':
+            return ArrayMap(self.width, self.height)
+        if storage != 'list':
+            self.log(f'map storage {storage!r} not supported. Fall back to list map storage', 'warn')
+        return [[None for _ in range(self.width)] for _ in range(self.height)]
+
+    def _logger(self):
+        return self.logger
+
     def _print_map(self):
         """ Print all objects on the map array. Just for debugging """
         for row in self.map:
@@ -0,0 +1,103 @@
+from itertools import count
+
+class Subscription(object):
+    __slots__ = ('event', 'callback', 'priority', 'once', 'active', '_bus', '_seq')
+
+    def __init__(self, bus: 'EventBus', event, callback, priority: int, once: bool, seq: int) -> None:
+        """ A handle of a subscribed callback, returned by the `subscribe` methods. Use `cancel` to unsubscribe. """
+        self.event = event        # the event subscribed to
+        self.callback = callback  # the subscribed callback
+        self.priority = priority  # callbacks with higher priority are called first
+        self.once = once          # whether the subscription is cancelled once the callback is called
+        self.active = True        # whether the subscription is still subscribed
+        self._bus = bus
+        self._seq = seq           # subscription order, to break ties in priority
+
+    def cancel(self) -> bool:
+        """ Unsubscribe the callback in O(1).
+        @return `true` if it was subscribed
+        """
+        return self._bus.cancel(self)
+
+    def __repr__(self) -> str:
+        state = 'active' if self.active else 'cancelled'
+        return f'<Subscription {self.event!r} {getattr(self.callback, "__name__", self.callback)!r} {state}>'
+
+
+class EventBus(object):
+    __slots__ = ('_subscriptions', '_order')
+    _seq = count()  # shared by every bus, only compared within a bus
+    _key = staticmethod(lambda subscription: (-subscription.priority, subscription._seq))
+
+    def __init__(self, events = ()) -> None:
+        """ Callbacks subscribed to events.
+        Every event keeps its subscriptions in a dict, so subscribing and cancelling take O(1).
+        The dispatch order, by priority and then by subscription order, is sorted on the first dispatch
+        after the subscriptions of an event change, and cached.
+        @param events - events that exist from the start
+        """
+        self._subscriptions = {event: {} for event in events}  # event -> {subscription: None}
+        self._order = {}                                       # event -> subscriptions in dispatch order
+
+    def add(self, event) -> None:
+        """ Register an event without any subscription """
+        self._subscriptions.setdefault(event, {})
+
+    def subscribe(self, event, callback, priority: int = 0, once: bool = False) -> Subscription:
+        """ Subscribe a callback to an event. The event is registered if it does not exist.
+        @return the `Subscription` handle
+        """
+        subscription = Subscription(self, event, callback, priority, once, next(self._seq))
+        self._subscriptions.setdefault(event, {})[subscription] = None
+        self._order.pop(event, None)
+        return subscription
+
+    def cancel(self, subscription: Subscription) -> bool:
+        """ Unsubscribe a subscription in O(1)
+        @return `true` if it was subscribed
+        """
+        if not subscription.active: return False
+        subscription.active = False
+        del self._subscriptions[subscription.event][subscription]
+        self._order.pop(subscription.event, None)
+        return True
+
+    def find(self, event, callback) -> Subscription:
+        """ @return the earliest active subscription of a callback to an event, or `None` """
+        for subscription in self._subscriptions.get(event, ()):
+            if subscription.callback == callback: return subscription
+        return None
+
+    def handlers(self, event) -> tuple:
+        """ @return the active subscriptions of an event in dispatch order """
+        order = self._order.get(event)
+        if order is None:
+            subscriptions = self._subscriptions.get(event)
+            if not subscriptions: return ()
+            order = self._order[event] = tuple(sorted(subscriptions, key=self._key))
+        return order
+
+    def dispatch(self, event, call) -> int:
+        """ Call `call(callback)` for every subscription of an event in dispatch order.
+        Subscriptions cancelled by an earlier callback are skipped, and the ones added are called from the next dispatch.
+        Once-only subscriptions are cancelled right before their callback is called.
+        @return how many callbacks are called
+        """
+        called = 0
+        for subscription in self.handlers(event):
+            if not subscription.active: continue
+            if subscription.once: self.cancel(subscription)
+            call(subscription.callback)
+            called += 1
+        return called
+
+    def items(self):
+        """ Yield (event, subscriptions in dispatch order) of every registered event """
+        for event in list(self._subscriptions):
+            yield event, self.handlers(event)
+
+    def __contains__(self, event) -> bool:
+        return event in self._subscriptions
+
+    def __iter__(self):
+        return iter(self._subscriptions)
@@ -0,0 +1,139 @@
+from collections import OrderedDict
+
+# (xx, xy, yx, yy) of the 8 octants around the origin
+OCTANTS = ((1, 0, 0, 1), (0, 1, 1, 0), (0, -1, 1, 0), (-1, 0, 0, 1),
+           (-1, 0, 0, -1), (0, -1, -1, 0), (0, 1, -1, 0), (1, 0, 0, -1))
+
+class FieldOfView(object):
+    def __init__(self, radius: int = 8, remember: bool = False, max_cache: int = 64) -> None:
+        """ Fog of war: only the tiles the character can see are drawn. Use it through `Engine(fov=FieldOfView())`.
+        Visibility is computed with recursive shadowcasting, and blocking items are opaque.
+        Results are cached per (position, radius). A cached result is only dropped when a tile it can see
+        starts or stops blocking, so the field of view is recomputed only when the character moves
+        somewhere new or the blockers around it change.
+        `visible` is the mask of the current frame. It's updated by `Engine.viewport` once per frame,
+        and tiles outside of it are drawn as the map filler without looking at the map.
+        @param radius - how far the character can see
+        @param remember - whether to keep drawing the items, but not the entities, of the tiles seen before
+        @param max_cache - how many results are cached
+        """
+        super().__init__()
+
+        self.radius = radius
+        self.remember = remember
+        self.max_cache = max_cache
+        self.visible = frozenset()   # tiles the character can see in this frame
+        self.explored = set()        # tiles seen before, only kept if `remember` is set
+        self.computes = 0            # how many times a field of view is computed rather than taken from the cache
+        self._game = None
+        self._key = None             # (x, y, radius) of `visible`
+        self._cache = OrderedDict()  # (x, y, radius) -> (visible tiles, opaque tiles among them), least recently used first
+
+    def bind(self, game) -> 'FieldOfView':
+        """ Called by the engine that uses this field of view """
+        self._game = game
+        game._tile_watchers.append(self)
+        return self
+
+    def update(self, game) -> frozenset:
+        """ Compute what the character sees. Called once per frame by `Engine.viewport`.
+        @return the visible tiles, {(x, y)}
+        """
+        key = (game.character[0], game.character[1], self.radius)
+        visible, _ = self._lookup(key)
+        if self.remember and key != self._key: self.explored |= visible
+        self.visible, self._key = visible, key
+        return visible
+
+    def compute(self, x: int, y: int, radius: int = None) -> frozenset:
+        """ Get the tiles visible from (x, y), e.g. to check whether an NPC can see the character. The result is cached.
+        @param radius - default to the radius of this field of view
+        @return the visible tiles, {(x, y)}
+        """
+        return self._lookup((x, y, self.radius if radius is None else radius))[0]
+
+    def is_visible(self, x: int, y: int) -> bool:
+        """ Whether the character can see the tile in this frame """
+        return (x, y) in self.visible
+
+    def _lookup(self, key: tuple) -> tuple:
+        """ @return (visible tiles, opaque tiles among them) from the cache, computing it if needed """
+        result = self._cache.get(key)
+        if result is not None:
+            self._cache.move_to_end(key)
+            return result
+        result = self._cache[key] = self._shadowcast(*key)
+        if len(self._cache) > self.max_cache: self._cache.popitem(last=False)
+        return result
+
+    def _update(self, x: int, y: int) -> None:
+        """ Called by the engine after the content of a tile is changed """
+        opaque = None
+        for key, (visible, seen) in list(self._cache.items()):
+            cx, cy, radius = key
+            if abs(x - cx) > radius or abs(y - cy) > radius: continue
+            if (x, y) in visible:
+                # tiles in the shadow never cast a shadow, so only visible tiles that change their opacity count
+                if opaque is None: opaque = self._opaque(x, y)
+                if opaque != ((x, y) in seen): del self._cache[key]
+            elif (x - cx) ** 2 + (y - cy) ** 2 > radius * radius + radius:
+                # tiles out of the radius are not visible, but they may still cast a shadow
+                del self._cache[key]
+
+    def _opaque(self, x: int, y: int) -> bool:
+        """ Whether the tile blocks the sight. Tiles outside the map are opaque. """
+        game = self._game
+        if not (0 <= x < game.height and 0 <= y < game.width): return True
+        item = game.map[x][y]
+        return item is not None and bool(item.block)
+
+    def _shadowcast(self, x: int, y: int, radius: int) -> tuple:
+        """ Recursive shadowcasting over the 8 octants around (x, y)
+        @return (visible tiles, opaque tiles among them)
+        """
+        self.computes += 1
+        visible, seen = {(x, y)}, set()
+        for octant in OCTANTS:
+            self._cast(x, y, 1, 1.0, 0.0, radius, octant, visible, seen)
+        return frozenset(visible), seen
+
+    def _cast(self, x: int, y: int, row: int, start: float, end: float, radius: int, octant: tuple,
+              visible: set, seen: set) -> None:
+        """ Scan the rows of an octant from `row` on, between the slopes `start` and `end`.
+        Every opaque tile casts a shadow, and the light around it is scanned by a recursive call.
+        """
+        if start < end: return
+        xx, xy, yx, yy = octant
+        game = self._game
+        height, width, map = game.height, game.width, game.map
+        limit = radius * radius + radius  # a round radius, rather than a diamond or a square
+        new_start = start
+        for j in range(row, radius + 1):
+            blocked = False
+            dy = -j
+            for dx in range(-j, 1):
+                left, right = (dx - 0.5) / (dy + 0.5), (dx + 0.5) / (dy - 0.5)
+                if start < right: continue
+                if end > left: break
+
+                tx, ty = x + dx * xx + dy * xy, y + dx * yx + dy * yy
+                inside = 0 <= tx < height and 0 <= ty < width
+                if inside:
+                    item = map[tx][ty]
+                    opaque = item is not None and bool(item.block)
+                    if dx * dx + dy * dy <= limit:
+                        visible.add((tx, ty))
+                        if opaque: seen.add((tx, ty))
+                else:
+                    opaque = True
+                if blocked:
+                    if opaque:
+                        new_start = right
+                        continue
+                    blocked = False
+                    start = new_start
+                elif opaque and j < radius:
+                    blocked = True
+                    self._cast(x, y, j + 1, start, left, radius, octant, visible, seen)
+                    new_start = right
+            if blocked: break
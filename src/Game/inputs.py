@@ -0,0 +1,123 @@
+from threading import Thread
+import queue
+PYNPUT_AVAILABLE = True
+try:
+    from pynput import keyboard
+except ImportError:
+    PYNPUT_AVAILABLE = False
+
+class InputSource(object):
+    # how the events are handled by the engine:
+    #  'stdin' events are strings, 'pynput' events are `keyboard.Events.Press/Release`
+    mode = 'stdin'
+    blocking = True  # whether `read` may wait for someone. Blocking sources are read in a thread by `Engine.run`
+    _queue = None    # events collected in the background, see `start`
+
+    def read(self, game):
+        """ Wait for the next event.
+        @return the event, or `None` if there will be no more events.
+        """
+        raise NotImplementedError
+
+    def start(self, game) -> None:
+        """ Start collecting events in the background for the real-time mode.
+        By default, a daemon thread keeps calling `read` and queues the events.
+        """
+        if self._queue is not None: return
+        self._queue = queue.Queue()
+        def collect():
+            while True:
+                event = self.read(game)
+                self._queue.put(event)
+                if event is None: return
+        Thread(target=collect, daemon=True).start()
+
+    def poll(self) -> list:
+        """ Take all events collected since the last poll, without waiting.
+        A `None` in the list means there will be no more events.
+        """
+        events = []
+        while True:
+            try:
+                events.append(self._queue.get_nowait())
+            except queue.Empty:
+                return events
+
+    def close(self) -> None:
+        """ Release the resources held by this source. Called after the game ends. """
+        return
+
+
+class StdinInput(InputSource):
+    """ Read a line from the standard input for every step """
+    mode = 'stdin'
+
+    def read(self, game) -> str:
+        return input('input: ').lower()
+
+
+class PynputInput(InputSource):
+    """ Read key events from the keyboard with a single long-lived pynput listener """
+    mode = 'pynput'
+
+    def __init__(self) -> None:
+        super().__init__()
+
+        self._queue = queue.Queue()
+        self._listener = None
+
+    def start(self, game) -> None:
+        if self._listener is not None: return
+        self._listener = keyboard.Listener(on_press=lambda key: self._queue.put(keyboard.Events.Press(key)),
+                                           on_release=lambda key: self._queue.put(keyboard.Events.Release(key)))
+        self._listener.start()
+
+    def read(self, game):
+        self.start(game)
+        return self._queue.get()
+
+    def close(self) -> None:
+        if self._listener is not None: self._listener.stop()
+        self._listener = None
+
+
+class ScriptedInput(InputSource):
+    blocking = False
+
+    def __init__(self, source, mode: str = 'stdin') -> None:
+        """ Feed pre-recorded or generated events to the engine, without waiting for anyone.
+        @param source - where the events come from. One of
+                        - an iterable of events,
+                        - a path or an opened file, one stdin event per line,
+                        - a function `source(game) -> event`, which returns `None` to stop.
+        @param mode - how the events should be handled by the engine. [stdin, pynput]
+        """
+        super().__init__()
+
+        self.mode = mode
+        self._file = None
+        self._next = None
+        self._game = None
+        if callable(source):
+            self._next = source
+            return
+        if isinstance(source, str):
+            source = self._file = open(source)
+        if hasattr(source, 'readline'):
+            source = (line.rstrip('\r\n') for line in source)
+        events = iter(source)
+        self._next = lambda game: next(events, None)
+
+    def read(self, game):
+        return self._next(game)
+
+    def start(self, game) -> None:
+        self._game = game
+
+    def poll(self) -> list:
+        """ Scripted events are fed one per tick, so the result does not depend on timing """
+        return [self._next(self._game)] if self._game is not None else []
+
+    def close(self) -> None:
+        if self._file: self._file.close()
+        self._file = None
@@ -0,0 +1,82 @@
+from collections import deque
+
+# severity of every log level
+LEVELS = {'debug': 10, 'info': 20, 'warn': 30, 'error': 40}
+
+class StdoutSink(object):
+    """ Print every message. This is the default sink. """
+
+    def write(self, message: str) -> None:
+        print(message)
+
+    def flush(self) -> None:
+        return
+
+
+class RingBufferSink(object):
+    def __init__(self, capacity: int = 10000) -> None:
+        """ Keep the latest messages in memory instead of printing them, so they don't mess up the frame.
+        @param capacity - how many messages to keep. Older messages are dropped.
+        """
+        super().__init__()
+
+        self.messages = deque(maxlen=capacity)
+
+    def write(self, message: str) -> None:
+        self.messages.append(message)
+
+    def dump(self) -> list:
+        """ Get all kept messages, oldest first """
+        return list(self.messages)
+
+    def flush(self) -> None:
+        return
+
+
+class FileSink(object):
+    def __init__(self, path: str) -> None:
+        """ Append every message to a file
+        @param path - path of the log file
+        """
+        super().__init__()
+
+        self.file = open(path, 'a')
+
+    def write(self, message: str) -> None:
+        self.file.write(message + '\n')
+
+    def flush(self) -> None:
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class Logger(object):
+    def __init__(self, sink = None) -> None:
+        """ Decide which messages are logged and where they go.
+        By default, debug messages are only logged by objects in debug mode, and the other messages always are.
+        Set a level for a subsystem (`engine`, `item`, `entity`, `timer`, `input`) to override that.
+        @param sink - where the messages go. Default to `StdoutSink`.
+        """
+        super().__init__()
+
+        self.sink = sink or StdoutSink()
+        self.levels = {}  # subsystem -> minimum severity
+
+    def set_level(self, subsystem: str, level: str) -> None:
+        """ Set the minimum level of messages to log for a subsystem. Set `None` to restore the default. """
+        if level is None: self.levels.pop(subsystem, None)
+        else:             self.levels[subsystem] = LEVELS[level.lower()]
+
+    def enabled(self, level: str, subsystem: str, debug: bool) -> bool:
+        """ Whether a message of the given level should be logged """
+        threshold = self.levels.get(subsystem)
+        if threshold is None: threshold = LEVELS['debug'] if debug else LEVELS['info']
+        return LEVELS.get(level.lower(), LEVELS['info']) >= threshold
+
+    def write(self, message: str) -> None:
+        self.sink.write(message)
+
+
+DEFAULT_LOGGER = Logger()
@@ -0,0 +1,279 @@
+from collections import OrderedDict, deque
+from heapq import heappush, heappop
+from typing import Tuple
+
+# neighbours of a tile, named after the default actions of `Engine.CONTROL_KEY`
+DIRECTIONS = (('up', -1, 0), ('down', 1, 0), ('left', 0, -1), ('right', 0, 1))
+
+class Pathfinder(object):
+    def __init__(self, game, max_paths: int = 1024, max_fields: int = 8) -> None:
+        """ Routes around blocking items, created by the engine on the first `Engine.find_path` or `Engine.distance_field`.
+        The character and the entities move one tile up, down, left or right at a time,
+        so routes are searched on the 4-neighbour grid and every step costs 1.
+        Only items block; entities and the character are ignored, since they move every step.
+        Blocking tiles are kept in a set that the engine updates whenever the content of a tile changes,
+        so searches never read the map. Items of dropped `ChunkMap` chunks keep blocking,
+        unless the chunk was dropped before the pathfinder was created.
+        Results are cached. A cached path is dropped only when a tile on it starts blocking,
+        or a tile that could make a shorter route stops blocking. A cached distance field is repaired
+        around the changed tiles on its next use, rather than recomputed.
+        @param max_paths - how many paths are cached
+        @param max_fields - how many distance fields are cached
+        """
+        super().__init__()
+
+        self.width = game.width
+        self.height = game.height
+        self.max_paths = max_paths
+        self.max_fields = max_fields
+        self.blocked = {(item.x, item.y) for item in game._items.find(block=True)}
+        self.searches = 0   # how many searches are run rather than answered from the cache
+        self._game = game
+        self._paths = OrderedDict()      # (start, goal) -> path or `None`, least recently used first
+        self._on_path = {}               # tile -> {(start, goal): None} of the cached paths through the tile
+        self._fields = OrderedDict()     # (sources, max distance) -> `DistanceField`, least recently used first
+
+    def find_path(self, start: Tuple[int,int], goal: Tuple[int,int]) -> list:
+        """ Find a shortest route with A*.
+        @return the tiles to walk through from `start`, excluding `start` and including `goal`,
+                or `None` if the goal can not be reached
+        """
+        key = (tuple(start), tuple(goal))
+        if key in self._paths:
+            self._paths.move_to_end(key)
+            return self._paths[key]
+
+        path = self._search(*key)
+        self._paths[key] = path
+        for tile in path or ():
+            self._on_path.setdefault(tile, {})[key] = None
+        if len(self._paths) > self.max_paths:
+            self._forget(next(iter(self._paths)))
+        return path
+
+    def distance_field(self, sources: list, max_distance: int = None) -> 'DistanceField':
+        """ Get the distance from every tile to the nearest source. See `DistanceField`. """
+        key = (frozenset(map(tuple, sources)), max_distance)
+        field = self._fields.get(key)
+        if field is None:
+            field = self._fields[key] = DistanceField(self, key[0], max_distance)
+            if len(self._fields) > self.max_fields: self._fields.popitem(last=False)
+        else:
+            self._fields.move_to_end(key)
+        field._refresh()
+        return field
+
+    def neighbours(self, x: int, y: int) -> list:
+        """ @return the tiles next to (x, y) that are inside the map and not blocked """
+        blocked, height, width = self.blocked, self.height, self.width
+        return [(x + dx, y + dy) for _, dx, dy in DIRECTIONS
+                if 0 <= x + dx < height and 0 <= y + dy < width and (x + dx, y + dy) not in blocked]
+
+    def _update(self, x: int, y: int) -> None:
+        """ Called by the engine after the content of a tile is changed """
+        item = self._game.map[x][y]
+        block = bool(item is not None and item.block)
+        tile = (x, y)
+        if block == (tile in self.blocked): return
+
+        if block:
+            self.blocked.add(tile)
+            for key in list(self._on_path.get(tile, ())):
+                self._forget(key)
+        else:
+            self.blocked.discard(tile)
+            # a route through the tile is at least as long as the Manhattan distances to it
+            for key, path in list(self._paths.items()):
+                (sx, sy), (gx, gy) = key
+                if path is None or abs(sx - x) + abs(sy - y) + abs(gx - x) + abs(gy - y) < len(path):
+                    self._forget(key)
+        for field in self._fields.values():
+            field._pending[tile] = None
+
+    def _forget(self, key: tuple) -> None:
+        """ Drop a cached path """
+        for tile in self._paths.pop(key) or ():
+            paths = self._on_path[tile]
+            del paths[key]
+            if not paths: del self._on_path[tile]
+
+    def _search(self, start: tuple, goal: tuple) -> list:
+        """ A* from `start` to `goal` """
+        self.searches += 1
+        if start == goal: return []
+        if goal in self.blocked or not (0 <= goal[0] < self.height and 0 <= goal[1] < self.width): return None
+
+        gx, gy = goal
+        blocked, height, width = self.blocked, self.height, self.width
+        came = {start: None}
+        cost = {start: 0}
+        queue = [(abs(start[0] - gx) + abs(start[1] - gy), 0, start)]
+        while queue:
+            _, g, tile = heappop(queue)
+            g = -g
+            if tile == goal:
+                path = []
+                while tile != start:
+                    path.append(tile)
+                    tile = came[tile]
+                path.reverse()
+                return path
+            if g > cost[tile]: continue # visited through a shorter route
+            x, y = tile
+            g += 1
+            for _, dx, dy in DIRECTIONS:
+                nx, ny = x + dx, y + dy
+                if not (0 <= nx < height and 0 <= ny < width): continue
+                next = (nx, ny)
+                if next in blocked or cost.get(next, g + 1) <= g: continue
+                cost[next] = g
+                came[next] = tile
+                # ties are broken towards the goal, so fewer tiles are expanded on open maps
+                heappush(queue, (g + abs(nx - gx) + abs(ny - gy), -g, next))
+        return None
+
+
+class DistanceField(object):
+    def __init__(self, pathfinder: Pathfinder, sources: frozenset, max_distance: int = None) -> None:
+        """ Distance from every reachable tile to the nearest source, e.g. for everyone chasing the character.
+        Get it with `Engine.distance_field`. It's also a flow field: `step` and `direction` point every tile
+        one tile closer to the nearest source, so any number of entities can follow it at O(1) per step.
+        It's computed with a multi-source breadth-first search, and when blocking tiles change,
+        only the distances that depend on the changed tiles are fixed.
+        @param sources - the tiles to get close to
+        @param max_distance - stop searching this far from the sources. Default to the whole map.
+        """
+        super().__init__()
+
+        self.sources = sources
+        self.max_distance = max_distance
+        self.dist = {}          # tile -> distance to the nearest source. Unreachable tiles are left out.
+        self._pathfinder = pathfinder
+        self._pending = {}      # tiles whose blocking changed since the last refresh: {tile: None}
+        self._compute()
+
+    def distance(self, x: int, y: int) -> int:
+        """ @return the number of steps from (x, y) to the nearest source, or `None` if it's unreachable """
+        return self.dist.get((x, y))
+
+    def step(self, x: int, y: int) -> Tuple[int,int]:
+        """ @return the next tile from (x, y) towards the nearest source,
+                    (x, y) itself on a source, or `None` if no source can be reached
+        """
+        d = self.dist.get((x, y))
+        if d is None: return None
+        if d == 0: return (x, y)
+        dist = self.dist
+        for _, dx, dy in DIRECTIONS:
+            if dist.get((x + dx, y + dy)) == d - 1: return (x + dx, y + dy)
+        return None
+
+    def direction(self, x: int, y: int) -> str:
+        """ @return the action ('up', 'down', 'left' or 'right') that moves (x, y) towards the nearest source, or `None` """
+        d = self.dist.get((x, y))
+        if not d: return None
+        dist = self.dist
+        for name, dx, dy in DIRECTIONS:
+            if dist.get((x + dx, y + dy)) == d - 1: return name
+        return None
+
+    def path(self, x: int, y: int) -> list:
+        """ @return the tiles from (x, y) to the nearest source, excluding (x, y), or `None` if it's unreachable """
+        if (x, y) not in self.dist: return None
+        path, tile = [], (x, y)
+        while self.dist[tile]:
+            tile = self.step(*tile)
+            path.append(tile)
+        return path
+
+    def _compute(self) -> None:
+        """ Multi-source breadth-first search from scratch """
+        pathfinder = self._pathfinder
+        blocked, height, width = pathfinder.blocked, pathfinder.height, pathfinder.width
+        limit = self.max_distance
+        dist = self.dist = {tile: 0 for tile in self.sources
+                            if tile not in blocked and 0 <= tile[0] < height and 0 <= tile[1] < width}
+        queue = deque(dist)
+        while queue:
+            tile = queue.popleft()
+            d = dist[tile] + 1
+            if limit is not None and d > limit: continue
+            x, y = tile
+            for _, dx, dy in DIRECTIONS:
+                nx, ny = x + dx, y + dy
+                if (nx, ny) in dist or not (0 <= nx < height and 0 <= ny < width) or (nx, ny) in blocked: continue
+                dist[nx, ny] = d
+                queue.append((nx, ny))
+        self._pathfinder.searches += 1
+
+    def _refresh(self) -> None:
+        """ Fix the distances around the tiles whose blocking changed """
+        pending, self._pending = self._pending, {}
+        for tile in pending:
+            if tile in self._pathfinder.blocked: self._block(tile)
+            else:                                self._unblock(tile)
+
+    def _block(self, tile: tuple) -> None:
+        """ A tile starts blocking: the tiles whose only shortest routes went through it get their distances again """
+        dist = self.dist
+        if tile not in dist: return
+        pathfinder = self._pathfinder
+        blocked = pathfinder.blocked
+
+        # tiles are visited in the order of distance, so a tile is checked after every tile closer to the sources
+        orphans = {tile: dist.pop(tile)}
+        queue = deque([tile])
+        while queue:
+            x, y = queue.popleft()
+            d = orphans[x, y] + 1
+            for _, dx, dy in DIRECTIONS:
+                next = (x + dx, y + dy)
+                if dist.get(next) != d: continue
+                nx, ny = next
+                if any(dist.get((nx + ex, ny + ey)) == d - 1 for _, ex, ey in DIRECTIONS): continue
+                orphans[next] = dist.pop(next)
+                queue.append(next)
+
+        # the orphans get their distances from the tiles around them that kept theirs
+        limit = self.max_distance
+        queue = []
+        for x, y in orphans:
+            if (x, y) in blocked: continue
+            around = [dist[x + dx, y + dy] for _, dx, dy in DIRECTIONS if (x + dx, y + dy) in dist]
+            if around: heappush(queue, (min(around) + 1, (x, y)))
+        while queue:
+            d, (x, y) = heappop(queue)
+            if (x, y) in dist or (limit is not None and d > limit): continue
+            dist[x, y] = d
+            for _, dx, dy in DIRECTIONS:
+                next = (x + dx, y + dy)
+                if next in orphans and next not in dist and next not in blocked: heappush(queue, (d + 1, next))
+
+    def _unblock(self, tile: tuple) -> None:
+        """ A tile stops blocking: distances only shrink, spreading out from the tile """
+        pathfinder = self._pathfinder
+        blocked, height, width = pathfinder.blocked, pathfinder.height, pathfinder.width
+        if not (0 <= tile[0] < height and 0 <= tile[1] < width): return
+        dist = self.dist
+        x, y = tile
+        if tile in self.sources:
+            d = 0
+        else:
+            around = [dist[x + dx, y + dy] for _, dx, dy in DIRECTIONS if (x + dx, y + dy) in dist]
+            if not around: return
+            d = min(around) + 1
+        limit = self.max_distance
+        if (limit is not None and d > limit) or dist.get(tile, d + 1) <= d: return
+
+        dist[tile] = d
+        queue = deque([tile])
+        while queue:
+            x, y = queue.popleft()
+            d = dist[x, y] + 1
+            if limit is not None and d > limit: continue
+            for _, dx, dy in DIRECTIONS:
+                nx, ny = x + dx, y + dy
+                if not (0 <= nx < height and 0 <= ny < width) or (nx, ny) in blocked: continue
+                if dist.get((nx, ny), d + 1) <= d: continue
+                dist[nx, ny] = d
+                queue.append((nx, ny))
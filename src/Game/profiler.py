@@ -0,0 +1,132 @@
+from collections import deque
+from time import perf_counter
+
+class Histogram(object):
+    def __init__(self, window: int = 1000) -> None:
+        """ Summary of a series of samples.
+        The count, total and maximum cover every sample, and the percentiles cover the latest `window` samples.
+        """
+        super().__init__()
+
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=window)
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        if value > self.max: self.max = value
+        self.recent.append(value)
+
+    def summary(self, scale: float = 1) -> dict:
+        """ @return count, mean, p50, p95, p99 and max of the samples, multiplied by `scale` """
+        if not self.count: return {'count': 0}
+        recent = sorted(self.recent)
+        pick = lambda q: recent[min(int(len(recent) * q), len(recent) - 1)] * scale
+        return {'count': self.count, 'mean': self.total / self.count * scale,
+                'p50': pick(0.5), 'p95': pick(0.95), 'p99': pick(0.99), 'max': self.max * scale}
+
+
+class StepProfiler(object):
+    def __init__(self, window: int = 1000, dump_every: int = None, dump = None) -> None:
+        """ Record where the time of every step goes.
+        @param window - how many recent samples the percentiles are computed from
+        @param dump_every - call `dump(stats)` every this many steps
+        @param dump - function that receives the statistics, see `Engine.stats`
+        """
+        super().__init__()
+
+        self.window = window
+        self.dump_every = dump_every
+        self.dump = dump
+        self.steps = 0
+        self.phases = {}     # phase -> Histogram of seconds
+        self.callbacks = {}  # qualified name -> Histogram of seconds
+        self.counts = {}     # what is counted -> Histogram of counts per step
+        self._names = {}     # code object of a callback -> qualified name
+
+    def lap(self, phase: str, start: float) -> float:
+        """ Record the time since `start` for a phase
+        @return current time, so that laps can be chained
+        """
+        now = perf_counter()
+        self._histogram(self.phases, phase).add(now - start)
+        return now
+
+    def call(self, callback, args: tuple):
+        """ Call a callback and record its time under its qualified name """
+        start = perf_counter()
+        try:
+            return callback(*args)
+        finally:
+            self._histogram(self.callbacks, self._name(callback)).add(perf_counter() - start)
+
+    def end_step(self, counts: dict):
+        """ Record the counts of a step, and dump the statistics if it's time to.
+        @return the statistics if they're dumped
+        """
+        self.steps += 1
+        for name, value in counts.items():
+            self._histogram(self.counts, name).add(value)
+        if self.dump_every and self.dump and self.steps % self.dump_every == 0:
+            stats = self.stats()
+            self.dump(stats)
+            return stats
+        return None
+
+    def stats(self) -> dict:
+        """ @return times in milliseconds of every phase and callback, and counts per step """
+        return {'steps': self.steps,
+                'phases': {name: hist.summary(1000) for name, hist in self.phases.items()},
+                'callbacks': {name: hist.summary(1000) for name, hist in self.callbacks.items()},
+                'counts': {name: hist.summary() for name, hist in self.counts.items()}}
+
+    def _histogram(self, table: dict, name: str) -> Histogram:
+        hist = table.get(name)
+        if hist is None: hist = table[name] = Histogram(self.window)
+        return hist
+
+    def _name(self, callback) -> str:
+        # cached by the code object rather than the callback, so that one-shot lambdas and bound methods
+        # are not kept alive, and the cache stays as small as the number of places the callbacks are defined at
+        code = getattr(getattr(callback, '__func__', callback), '__code__', None)
+        if code is None: return self._qualname(callback)
+        name = self._names.get(code)
+        if name is None: name = self._names[code] = self._qualname(callback)
+        return name
+
+    @staticmethod
+    def _qualname(callback) -> str:
+        qualname = getattr(callback, '__qualname__', type(callback).__qualname__)
+        return f'{getattr(callback, "__module__", None) or "?"}.{qualname}'
+
+
+class NullProfiler(object):
+    """ Stands in for a `StepProfiler` while profiling is off, so a step runs the same code either way """
+    __slots__ = ()
+
+    def lap(self, phase: str, start: float) -> float:
+        return start
+
+    def call(self, callback, args: tuple):
+        return callback(*args)
+
+    def end_step(self, counts: dict):
+        return None
+
+NULL_PROFILER = NullProfiler()
+
+
+def format_stats(stats: dict) -> str:
+    """ Format the statistics from `Engine.stats` into a readable table """
+    lines = [f'--- profile after {stats["steps"]} steps (ms) ---']
+    for title in ('phases', 'callbacks'):
+        for name, row in sorted(stats[title].items(), key=lambda kv: -kv[1].get('mean', 0)):
+            if not row['count']: continue
+            lines.append(f'{title[:-1]:8} {name:40} n={row["count"]:<7} mean={row["mean"]:.3f} '
+                         f'p95={row["p95"]:.3f} max={row["max"]:.3f}')
+    for name, row in stats['counts'].items():
+        if not row['count']: continue
+        lines.append(f'{"count":8} {name:40} mean={row["mean"]:.1f} max={row["max"]:.0f}')
+    return '\n'.join(lines)
@@ -0,0 +1,108 @@
+from operator import attrgetter
+
+class ItemRegistry(object):
+    # item properties that can be queried through `find`
+    INDEXED = ('name', 'symbol', 'hidden', 'block')
+    _keys = staticmethod(attrgetter(*INDEXED))
+
+    def __init__(self) -> None:
+        """ Keep track of every live item on the map.
+        Items are kept in insertion order, so iterating the registry costs O(live items)
+        no matter how large the map is.
+        Every property in `INDEXED` has its own index, so `find` only visits matching items.
+        """
+        super().__init__()
+
+        self._items = {}  # item -> indexed values at the time it was (re)indexed
+        self._index = {field: {} for field in self.INDEXED} # field -> value -> {item: None}
+
+    def add(self, item) -> None:
+        """ Register a new item. """
+        if item in self._items: return
+        keys = self._keys(item)
+        self._items[item] = keys
+        for field, value in zip(self.INDEXED, keys):
+            self._index[field].setdefault(value, {})[item] = None
+
+    def add_many(self, items: list) -> None:
+        """ Register a batch of new items. Items sharing the same properties are indexed together. """
+        groups = {}
+        for item in items:
+            if item in self._items: continue
+            keys = self._keys(item)
+            self._items[item] = keys
+            groups.setdefault(keys, []).append(item)
+        for keys, group in groups.items():
+            for field, value in zip(self.INDEXED, keys):
+                self._index[field].setdefault(value, {}).update(dict.fromkeys(group))
+
+    def restore(self, items: list, buckets: dict) -> None:
+        """ Register items with their indexes given in order, e.g. when loading a snapshot.
+        It keeps `find` returning items in the same order as when the indexes were exported with `buckets`.
+        @param items - items in insertion order
+        @param buckets - field -> list of buckets, every bucket being a list of items with the same value
+        """
+        keys = self._keys
+        self._items.update(zip(items, map(keys, items)))
+        for i, field in enumerate(self.INDEXED):
+            index = self._index[field]
+            for bucket in buckets[field]:
+                index.setdefault(keys(bucket[0])[i], {}).update(dict.fromkeys(bucket))
+
+    def buckets(self, field: str) -> list:
+        """ @return the buckets of an index in order, every bucket being a dict of items with the same value """
+        return list(self._index[field].values())
+
+    def discard(self, item) -> bool:
+        """ Unregister an item.
+        @return `true` if the item was registered.
+        """
+        keys = self._items.pop(item, None)
+        if keys is None: return False
+        for field, value in zip(self.INDEXED, keys):
+            self._unindex(field, value, item)
+        return True
+
+    def update(self, item) -> None:
+        """ Re-index an item after its properties are changed. """
+        old = self._items.get(item)
+        if old is None: return
+        new = self._keys(item)
+        if new == old: return
+        for field, before, after in zip(self.INDEXED, old, new):
+            if before == after: continue
+            self._unindex(field, before, item)
+            self._index[field].setdefault(after, {})[item] = None
+        self._items[item] = new
+
+    def find(self, **props) -> list:
+        """ Find items that match all given properties. Properties set to `None` are ignored.
+        The smallest matching index is scanned and checked against the others,
+        so the cost depends on the number of candidates rather than the number of items.
+        @return a list of matched items
+        """
+        buckets = []
+        for field, value in props.items():
+            if value is None: continue
+            bucket = self._index[field].get(value)
+            if not bucket: return []
+            buckets.append(bucket)
+
+        if not buckets: return list(self._items)
+        buckets.sort(key=len)
+        first, rest = buckets[0], buckets[1:]
+        return [item for item in first if all(item in bucket for bucket in rest)]
+
+    def _unindex(self, field: str, value, item) -> None:
+        bucket = self._index[field][value]
+        del bucket[item]
+        if not bucket: del self._index[field][value]
+
+    def __contains__(self, item) -> bool:
+        return item in self._items
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __len__(self) -> int:
+        return len(self._items)
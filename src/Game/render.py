@@ -0,0 +1,66 @@
+import shutil
+import sys
+
+class DiffRenderer(object):
+    def __init__(self, stream=None) -> None:
+        """ A map renderer that only redraws the tiles changed since the last frame.
+        The frame is drawn at the top-left corner of the terminal with ANSI escape codes,
+        and every frame is sent with a single buffered write.
+        The whole frame is repainted on the first call, after the terminal or the map is resized,
+        and after the layer is switched. With a camera, only the viewport is drawn, see `Engine.viewport`.
+        Use it through `Engine(map_renderer=DiffRenderer())` or `Engine.add_layer`.
+        @param stream - where to write the frame. Default to `sys.stdout`.
+        """
+        super().__init__()
+
+        self.stream = stream
+        self._frame = None  # rows of tiles of the last frame
+        self._size = None   # (terminal size, map size) of the last frame
+
+    def invalidate(self) -> None:
+        """ Force the next frame to be fully repainted """
+        self._frame = None
+
+    def __call__(self, game) -> None:
+        stream = self.stream or sys.stdout
+        x0, y0, x1, y1 = game.viewport()
+        frame = [[game._get_tile(i, j) for j in range(y0, y1)] for i in range(x0, x1)]
+        width, height = y1 - y0, x1 - x0
+        size = (shutil.get_terminal_size(), width, height, game.pixel_width)
+
+        if self._frame is None or size != self._size:
+            output = self._repaint(game, frame, width)
+        else:
+            output = self._diff(game, frame, width, height)
+        self._frame, self._size = frame, size
+
+        stream.write(output)
+        stream.flush()
+        return
+
+    def _repaint(self, game, frame: list, width: int) -> str:
+        """ Draw the whole frame from a cleared screen """
+        border = '-' * width * game.pixel_width
+        lines = [f'time: {game._timestamp:3}', f'.{border}.']
+        lines.extend(f'|{"".join(row)}|' for row in frame)
+        lines.append(f"'{border}'")
+        return '\x1b[H\x1b[2J' + '\n'.join(lines) + '\n'
+
+    def _diff(self, game, frame: list, width: int, height: int) -> str:
+        """ Draw only the tiles that differ from the last frame """
+        output = [f'\x1b[1;1Htime: {game._timestamp:3}']
+        for i, (row, last) in enumerate(zip(frame, self._frame)):
+            if row == last: continue
+            j = 0
+            while j < width:
+                if row[j] == last[j]:
+                    j += 1
+                    continue
+                start = j
+                while j < width and row[j] != last[j]: j += 1
+                # the frame starts at line 3 and every row starts with a '|'
+                output.append(f'\x1b[{i + 3};{start * game.pixel_width + 2}H')
+                output.append(''.join(row[start:j]))
+        # leave the cursor below the frame and clear what was printed there
+        output.append(f'\x1b[{height + 4};1H\x1b[J')
+        return ''.join(output)
@@ -0,0 +1,251 @@
+from bisect import bisect_left, bisect_right
+import pickle
+
+from . import snapshot
+from .inputs import InputSource
+
+class Recording(object):
+    def __init__(self, game, checkpoint_every: int = 100, handlers: snapshot.HandlerRegistry = None) -> None:
+        """ Record a game, so that it can be jumped to any timestamp or stepped backward later.
+        Use `Engine.record` to start recording rather than creating this directly.
+        What is recorded:
+          - every event from the input source, with the timestamp it was handled at,
+          - the seed of `Engine.random`,
+          - a snapshot of the whole game every `checkpoint_every` steps, see `snapshot`,
+          - the tiles changed by every step, with their content before and after the step,
+            as well as the position of the character and the entities that moved.
+        @param game - the game to record
+        @param checkpoint_every - how many steps between two snapshots.
+                                  Seeking costs at most `checkpoint_every / 2` steps of deltas.
+        @param handlers - a `snapshot.HandlerRegistry` to save the callbacks in the snapshots by name
+        """
+        super().__init__()
+
+        self.checkpoint_every = checkpoint_every
+        self.handlers = handlers or snapshot.HandlerRegistry()
+        self.seed = game.seed
+        self.mode = game.input
+        self.start = game._timestamp   # timestamp at which the recording started
+        self.end = game._timestamp     # latest recorded timestamp
+        self.inputs = {}               # timestamp -> events handled at that timestamp
+        self.checkpoints = {}          # timestamp -> snapshot
+        self.deltas = {}               # timestamp -> ({(x, y): (before, after)}, (character before, after),
+                                       #               {entity id: (before, after)})
+        self._timestamps = []          # sorted timestamps of the checkpoints
+        self._dirty = {}               # (x, y) -> content before the current step, for tiles changed in the current step
+        self._dirty_entities = {}      # entity id -> state before the current step, for entities changed in the current step
+        self._character = tuple(game.character)
+        self._checkpoint(game)
+
+    ### ------ PLAYBACK ------ ###
+
+    def seek(self, timestamp: int, move_function, **kwargs):
+        """ Rebuild the map at a timestamp from the nearest checkpoint and the tile deltas in between.
+        The items, the character and the timestamp are exact. Items created after the checkpoint
+        come back without their subscriptions and timers, so use `resume` to run the game from there.
+        @param move_function - the movement controller, see `Engine.__init__`
+        @param kwargs - other arguments of `Engine.__init__`
+        @return an `Engine` at the timestamp
+        """
+        self._check_range(timestamp)
+        checkpoint = self._nearest(timestamp)
+        game = snapshot.loads(self.checkpoints[checkpoint], move_function, self.handlers, **kwargs)
+        self.step(game, timestamp - checkpoint)
+        return game
+
+    def step(self, game, steps: int = 1) -> int:
+        """ Move a game returned by `seek` forward, or backward if `steps` is negative, by applying the tile deltas.
+        No callback is called.
+        @return the timestamp of the game after stepping
+        """
+        target = game._timestamp + steps
+        self._check_range(target)
+        while game._timestamp < target:
+            game._timestamp += 1
+            self._apply(game, game._timestamp, 1)
+        while game._timestamp > target:
+            self._apply(game, game._timestamp, 0)
+            game._timestamp -= 1
+        return game._timestamp
+
+    def resume(self, timestamp: int, move_function, **kwargs):
+        """ Rebuild the game at the last checkpoint at or before a timestamp, fed with the events recorded from there.
+        Run it with `start` as usual (the same real-time setting as the recorded game) to reproduce the session.
+        Skip rendering until the timestamp is reached to get there quickly.
+        @param move_function - the movement controller, see `Engine.__init__`
+        @param kwargs - other arguments of `Engine.__init__`, except `input`
+        @return an `Engine` at the checkpoint
+        """
+        self._check_range(timestamp)
+        checkpoint = self._timestamps[bisect_right(self._timestamps, timestamp) - 1]
+        return snapshot.loads(self.checkpoints[checkpoint], move_function, self.handlers,
+                              input=ReplayInput(self, checkpoint), **kwargs)
+
+    ### ------ PERSISTENCE ------ ###
+
+    def save(self, path: str) -> None:
+        """ Save the recording into a file, e.g. to attach it to a bug report.
+        The events have to be picklable, which the events of stdin and pynput are.
+        """
+        state = {key: value for key, value in self.__dict__.items() if key not in ('handlers', '_dirty', '_dirty_entities')}
+        with open(path, 'wb') as f:
+            pickle.dump(state, f)
+
+    @classmethod
+    def load(cls, path: str, handlers: snapshot.HandlerRegistry = None) -> 'Recording':
+        """ Load a recording written by `save`. Only load files you trust, since they are unpickled.
+        @param handlers - a `snapshot.HandlerRegistry` to bind the callbacks in the snapshots
+        """
+        recording = cls.__new__(cls)
+        with open(path, 'rb') as f:
+            recording.__dict__.update(pickle.load(f))
+        recording.handlers = handlers or snapshot.HandlerRegistry()
+        recording._dirty = {}
+        recording._dirty_entities = {}
+        return recording
+
+    ### ------ RECORDING ------ ###
+
+    def _input(self, game, event) -> None:
+        """ Called by the engine before an event is handled. `None`, the end of the input, is recorded too. """
+        self.inputs.setdefault(game._timestamp, []).append(event)
+
+    def _touch(self, game, x: int, y: int) -> None:
+        """ Called by the engine right before the content of a tile is changed """
+        if (x, y) not in self._dirty:
+            self._dirty[(x, y)] = _tile_state(game, x, y)
+
+    def _touch_entity(self, game, entity) -> None:
+        """ Called by the engine right before an entity is added, moved or removed """
+        if entity.id not in self._dirty_entities:
+            self._dirty_entities[entity.id] = _entity_state(game, entity.id)
+
+    def _end_step(self, game) -> None:
+        """ Called by the engine at the end of every step """
+        tiles = {}
+        for (x, y), before in self._dirty.items():
+            after = _tile_state(game, x, y)
+            if after != before: tiles[(x, y)] = (before, after)
+        entities = {}
+        for id, before in self._dirty_entities.items():
+            after = _entity_state(game, id)
+            if after != before: entities[id] = (before, after)
+        self._dirty, self._dirty_entities = {}, {}
+        character = tuple(game.character)
+        moved = (self._character, character) if character != self._character else None
+        self._character = character
+        if tiles or moved or entities: self.deltas[game._timestamp] = (tiles, moved, entities)
+        self.end = game._timestamp
+        if game._timestamp % self.checkpoint_every == 0:
+            self._checkpoint(game)
+
+    def _checkpoint(self, game) -> None:
+        self.checkpoints[game._timestamp] = snapshot.dumps(game, self.handlers, warn=not self.checkpoints)
+        if not self._timestamps or self._timestamps[-1] < game._timestamp:
+            self._timestamps.append(game._timestamp)
+        game.log('checkpoint at %d', 'debug', game._timestamp)
+
+    ### ------ UTILITIES ------ ###
+
+    def _nearest(self, timestamp: int) -> int:
+        """ @return the checkpoint closest to the timestamp """
+        i = bisect_left(self._timestamps, timestamp)
+        candidates = self._timestamps[max(i - 1, 0):i + 1]
+        return min(candidates, key=lambda checkpoint: abs(checkpoint - timestamp))
+
+    def _check_range(self, timestamp: int) -> None:
+        if not self.start <= timestamp <= self.end:
+            raise ValueError(f'timestamp {timestamp} is not recorded. Recorded: {self.start} to {self.end}')
+
+    def _apply(self, game, timestamp: int, side: int) -> None:
+        """ Apply the delta of a step. `side` is 1 to go forward and 0 to go backward. """
+        delta = self.deltas.get(timestamp)
+        if delta is None: return
+        tiles, moved, entities = delta
+        for (x, y), states in tiles.items():
+            _set_tile_state(game, x, y, states[side])
+        if moved: game.position(*moved[side])
+        for id, states in entities.items():
+            _set_entity_state(game, id, states[side])
+
+
+class ReplayInput(InputSource):
+    blocking = False
+
+    def __init__(self, recording: Recording, start: int = None) -> None:
+        """ Feed the events of a recording to the engine at the timestamps they were handled.
+        Use `Recording.resume` rather than creating this directly.
+        @param start - the first timestamp to replay from. Default to the start of the recording.
+        """
+        super().__init__()
+
+        self.mode = recording.mode
+        self._recording = recording
+        self._game = None
+        start = recording.start if start is None else start
+        self._events = iter([event for timestamp in sorted(recording.inputs) if timestamp >= start
+                             for event in recording.inputs[timestamp]])
+
+    def read(self, game):
+        return next(self._events, None)
+
+    def start(self, game) -> None:
+        self._game = game
+
+    def poll(self) -> list:
+        """ Events handled at the current timestamp, or `None` once the recording ends """
+        if self._game is None: return []
+        timestamp = self._game._timestamp
+        if timestamp > self._recording.end: return [None]
+        events = self._recording.inputs.get(timestamp, [])
+        for _ in events: next(self._events, None) # keep `read` in step
+        return list(events)
+
+
+def _tile_state(game, x: int, y: int):
+    """ Content of a tile that is recorded in the deltas: the state of every item on it from the bottom, or `None` """
+    items = game._items_at(x, y)
+    if not items: return None
+    return tuple((item.name, item.symbol, item.block, item.hidden, item.life, item.created, item.z) for item in items)
+
+def _set_tile_state(game, x: int, y: int, state) -> None:
+    """ Set the content of a tile, without firing any event """
+    from .core import Item
+    from .util import padded
+
+    items = game._items_at(x, y)
+    state = state or ()
+    if len(items) == len(state) and all((item.name, item.life, item.created, item.z) == (s[0], s[4], s[5], s[6])
+                                        for item, s in zip(items, state)):
+        for item, (_, symbol, block, hidden, *_) in zip(items, state):
+            item.symbol, item.block, item.hidden = symbol, block, hidden
+            item.tile = padded(item.symbol, game.pixel_width)
+        if items: game._on_item_update(*items)
+        return
+    for item in items: game._detach(item)
+    for name, symbol, block, hidden, life, created, z in state:
+        item = Item(name, x, y, created, symbol, life, block, hidden, z, debug=game.debug, parent=game)
+        item.tile = padded(symbol, game.pixel_width)
+        game._place(item)
+
+def _entity_state(game, id: int):
+    """ State of an entity that is recorded in the deltas """
+    entity = game._entities.get(id)
+    if entity is None: return None
+    return (entity.name, entity.x, entity.y, entity.symbol, entity.block, entity.hidden)
+
+def _set_entity_state(game, id: int, state) -> None:
+    """ Add, move or remove an entity, without firing any event. Entities that were not in the checkpoint come back without policy or callbacks. """
+    from .core import Entity
+    from .util import padded
+
+    entity = game._entities.get(id)
+    if entity is not None: game._remove_entity(entity)
+    if state is None: return
+    name, x, y, symbol, block, hidden = state
+    if entity is None:
+        entity = Entity(id, name, x, y, symbol, game.move_cb, None, block, hidden, debug=game.debug, parent=game)
+    entity.parent = game
+    entity.name, entity.x, entity.y, entity.symbol, entity.block, entity.hidden = state
+    entity.tile = padded(symbol, game.pixel_width)
+    game._add_entity(entity)
@@ -0,0 +1,82 @@
+from itertools import count
+import heapq
+
+class TimerId(int):
+    """ The id of a timer. Awaiting it waits until the timer is fired (see `Engine.run`). """
+
+    def __new__(cls, id: int, engine) -> 'TimerId':
+        timer = super().__new__(cls, id)
+        timer._engine = engine
+        return timer
+
+    def __await__(self):
+        return self._engine._wait_timer(self).__await__()
+
+
+class Scheduler(object):
+    def __init__(self) -> None:
+        """ A timer queue keyed by absolute timestamp.
+        Timer ids are unique and increasing. Cancelling only marks the entry,
+        so both scheduling and cancelling are O(log n) at most,
+        and a tick only touches the timers that are actually due.
+        """
+        super().__init__()
+
+        self._queue = []        # heap of [due, id, callback, args]
+        self._entries = {}      # id -> entry, for pending timers only
+        self._ids = count(1)
+        self._cancelled = 0     # number of cancelled entries still in the heap
+
+    def schedule(self, due: int, callback, *args) -> int:
+        """ Schedule `callback(id, *args)` to be called at timestamp `due`.
+        @return the id of the timer
+        """
+        id = next(self._ids)
+        entry = [due, id, callback, args]
+        self._entries[id] = entry
+        heapq.heappush(self._queue, entry)
+        return id
+
+    def cancel(self, id: int) -> bool:
+        """ Cancel a pending timer.
+        @return `true` if the timer is cancelled.
+        """
+        entry = self._entries.pop(id, None)
+        if entry is None: return False
+        entry[2] = None
+        self._cancelled += 1
+        if self._cancelled > 64 and self._cancelled > len(self._queue) // 2:
+            self._compact()
+        return True
+
+    def due(self, id: int) -> int:
+        """ Get the timestamp when a pending timer will be fired.
+        @return the timestamp, or `None` if the timer is not pending.
+        """
+        entry = self._entries.get(id)
+        return entry[0] if entry else None
+
+    def pop_due(self, now: int):
+        """ Yield every timer that is due at `now`, in (timestamp, id) order.
+        Timers scheduled or cancelled while iterating are respected.
+        @return (id, callback, args)
+        """
+        while self._queue and self._queue[0][0] <= now:
+            due, id, callback, args = heapq.heappop(self._queue)
+            if callback is None:
+                self._cancelled -= 1
+                continue
+            del self._entries[id]
+            yield id, callback, args
+
+    def _compact(self) -> None:
+        """ Drop cancelled entries from the heap """
+        self._queue = [entry for entry in self._queue if entry[2] is not None]
+        heapq.heapify(self._queue)
+        self._cancelled = 0
+
+    def __contains__(self, id: int) -> bool:
+        return id in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
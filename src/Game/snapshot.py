@@ -0,0 +1,318 @@
+from array import array
+import gc
+import json
+import mmap
+from operator import itemgetter
+import struct
+import sys
+
+from .registry import ItemRegistry
+
+MAGIC = b'GAMESNAP'
+VERSION = 1
+HEADER = struct.Struct('<8sII')  # magic, version, length of the JSON header
+# columns of the item table: name -> array typecode
+#  `life_timer` is the id of the life timer of the item, and `order_*` lists the items of every index bucket of
+#  the registry in order, so that timers fire and `find_item` returns items in the same order after loading.
+COLUMNS = (('x', 'i'), ('y', 'i'), ('name', 'i'), ('symbol', 'i'), ('flags', 'B'), ('life', 'i'), ('created', 'q'),
+           ('life_timer', 'q'), *((f'order_{field}', 'i') for field in ItemRegistry.INDEXED))
+BLOCK, HIDDEN, TOUCHED = 1, 2, 4
+NO_LIFE = -1
+
+class HandlerRegistry(object):
+    def __init__(self, handlers: dict = None) -> None:
+        """ Named callbacks, so that subscriptions and timers can be saved and bound again after loading.
+        @param handlers - initial handlers, {name: function}
+        """
+        super().__init__()
+
+        self._handlers = {}
+        self._names = {}
+        for name, handler in (handlers or {}).items():
+            self.add(name, handler)
+
+    def add(self, name: str, handler) -> None:
+        """ Register a handler under a name """
+        self._handlers[name] = handler
+        self._names[handler] = name
+
+    def register(self, name: str = None):
+        """ Decorator version of `add`. The qualified name of the function is used by default. """
+        def decorator(handler):
+            self.add(name or handler.__qualname__, handler)
+            return handler
+        return decorator
+
+    def name_of(self, handler) -> str:
+        """ @return the name of a registered handler, or `None` """
+        try:
+            return self._names.get(handler)
+        except TypeError: # unhashable callable
+            return None
+
+    def get(self, name: str):
+        """ @return the handler registered under the name, or `None` """
+        return self._handlers.get(name)
+
+
+def dumps(engine, handlers: HandlerRegistry = None, warn: bool = True) -> bytes:
+    """ Serialize the state of an engine. See `Engine.save`
+    @param warn - whether to warn about the callbacks that are not in the handler registry
+    """
+    handlers = handlers or HandlerRegistry()
+    items = list(engine._items)
+    index = {item: i for i, item in enumerate(items)}
+    strings, string_id = [], {}
+    def intern(string):
+        if string not in string_id:
+            string_id[string] = len(strings)
+            strings.append(string)
+        return string_id[string]
+
+    columns = {
+        'x': array('i', [item.x for item in items]),
+        'y': array('i', [item.y for item in items]),
+        'name': array('i', [intern(item.name) for item in items]),
+        'symbol': array('i', [intern(item.symbol) for item in items]),
+        'flags': array('B', [BLOCK * bool(item.block) | HIDDEN * bool(item.hidden) | TOUCHED * bool(item.istouched)
+                             for item in items]),
+        'life': array('i', [NO_LIFE if item.life is None else item.life for item in items]),
+        'created': array('q', [item.created for item in items]),
+        'life_timer': array('q', [engine._life_timer.get(item, NO_LIFE) for item in items]),
+    }
+    buckets = {}
+    for field in ItemRegistry.INDEXED:
+        groups = engine._items.buckets(field)
+        columns[f'order_{field}'] = array('i', [index[item] for group in groups for item in group])
+        buckets[field] = [len(group) for group in groups]
+
+    skipped = []
+    def name_of(callback):
+        name = handlers.name_of(callback)
+        if name is None and callback is not None: skipped.append(callback)
+        return name
+    def named(rows):
+        """ Drop the rows whose callback is not registered. A timer without a callback is kept. """
+        return [row for row, callback in rows if row[-1] is not None or callback is None]
+
+    header = {
+        'width': engine.width, 'height': engine.height, 'pixel_width': engine.pixel_width,
+        'character_char': engine.character_char, 'map_filler': engine.map_filler,
+        'character': list(engine.character), 'timestamp': engine._timestamp, 'layer': engine.layer,
+        'backpack': engine.backpack, 'strings': strings, 'count': len(items),
+        'seed': engine.seed, 'random': engine.random.getstate(),
+        'buckets': buckets,
+        # z-order of the items that have one: [item, z], and items of the stacked tiles from the bottom: [item, ...]
+        'z': [[i, item.z] for i, item in enumerate(items) if item.z is not None],
+        'stacks': [[index[item] for item in stack.items] for stack in engine._stacks.values()],
+        # pending timers: [id, due, handler] and [id, item, due, handler]
+        'timers': named(([id, engine._scheduler.due(id), name_of(callback)], callback)
+                        for id, (_, callback) in engine._timer.items()),
+        'item_timers': named(([id, index[item], engine._scheduler.due(id), name_of(callback)], callback)
+                             for item in items if item._timer for id, (_, callback) in item._timer.items()),
+        # subscriptions in dispatch order: [event, handler, priority, once]
+        'events': named(([event, *_subscription(name_of, sub)], sub.callback)
+                        for event, subs in engine._subscription.items() for sub in subs),
+        'custom_events': [event for event in engine._subscription if event not in engine.DEFAULT_EVENT],
+        'deferred': engine._deferred,
+        'keyboard': named(([event, _key_name(key), *_subscription(name_of, sub)], sub.callback)
+                          for event, bus in engine._kb_callback.items() for key, subs in bus.items() for sub in subs),
+        'item_events': named(([index[item], event, *_subscription(name_of, sub)], sub.callback)
+                             for item in items if item._callback for event, subs in item._callback.items() for sub in subs),
+        # entities: [id, name, x, y, symbol, block, hidden, move function, policy]
+        #  the move function is `None` if it's the one of the engine
+        'entities': [[entity.id, entity.name, entity.x, entity.y, entity.symbol, entity.block, entity.hidden,
+                      None if entity.move_cb == engine.move_cb else name_of(entity.move_cb),
+                      name_of(entity.policy) if entity.policy else None] for entity in engine._entities.values()],
+        'entity_id': engine._entity_id,
+        'entity_events': named(([entity.id, event, *_subscription(name_of, sub)], sub.callback) for entity in engine._entities.values()
+                               if entity._callback for event, subs in entity._callback.items() for sub in subs),
+        'layers': named(([name, name_of(renderer)], renderer) for name, renderer in engine._layer_renderer.items() if name != 'map'),
+    }
+    if skipped and warn:
+        engine.log(f'{len(skipped)} callbacks are not in the handler registry and are not saved', 'warn')
+
+    body, offsets = [], {}
+    offset = 0
+    for name, _ in COLUMNS:
+        data = columns[name].tobytes()
+        offsets[name] = offset
+        body.append(data)
+        body.append(b'\0' * (-len(data) % 8)) # keep every column aligned
+        offset += len(data) + (-len(data) % 8)
+    header['columns'] = offsets
+    header['byteorder'] = sys.byteorder
+
+    encoded = json.dumps(header, default=_unsupported(engine)).encode('utf-8')
+    encoded += b' ' * (-(HEADER.size + len(encoded)) % 8)
+    return HEADER.pack(MAGIC, VERSION, len(encoded)) + encoded + b''.join(body)
+
+def save(engine, path: str, handlers: HandlerRegistry = None) -> None:
+    """ Save the state of an engine into a file. See `Engine.save` """
+    with open(path, 'wb') as f:
+        f.write(dumps(engine, handlers))
+
+def loads(data, move_function, handlers: HandlerRegistry = None, **kwargs):
+    """ Create an engine from serialized state. See `Engine.load`
+    Raise `ValueError` if the data is not a snapshot, or it's corrupted or truncated.
+    """
+    buffer = memoryview(data)
+    views = [buffer]  # views on the data, released even if loading fails so that the data can be closed
+    try:
+        header, columns = _read(buffer, views)
+        return _restore(header, columns, move_function, handlers, **kwargs)
+    finally:
+        for view in reversed(views): view.release()
+
+def _read(buffer: memoryview, views: list) -> tuple:
+    """ Check the header of a snapshot and map its columns
+    @param views - the views created on the buffer are added here
+    @return (header, columns)
+    """
+    if len(buffer) < HEADER.size:
+        raise ValueError('not a snapshot: the file is too short')
+    magic, version, length = HEADER.unpack_from(buffer)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f'not a snapshot of version {VERSION}')
+    if len(buffer) < HEADER.size + length:
+        raise ValueError('snapshot is truncated in the header')
+    try:
+        header = json.loads(bytes(buffer[HEADER.size:HEADER.size + length]).decode('utf-8'))
+        offsets, count = header['columns'], header['count']
+        if header['byteorder'] != sys.byteorder:
+            raise ValueError('snapshot was saved on a machine with a different byte order')
+    except (KeyError, TypeError) as e:
+        raise ValueError(f'snapshot header is corrupted: {e!r}') from None
+    body = buffer[HEADER.size + length:]
+    views.append(body)
+    columns = {}
+    for name, typecode in COLUMNS:
+        start = offsets.get(name)
+        size = array(typecode).itemsize * count
+        if start is None or start < 0 or start + size > len(body):
+            raise ValueError(f'snapshot is truncated: column {name!r} is out of the data')
+        column = body[start:start + size]
+        views.append(column)
+        columns[name] = column.cast(typecode)
+        views.append(columns[name])
+    return header, columns
+
+def _restore(header: dict, columns: dict, move_function, handlers: HandlerRegistry = None, **kwargs):
+    """ Create an engine from the header and the columns of a snapshot, see `loads` """
+    from .core import Engine, Entity, Item
+    from .util import padded
+
+    count = header['count']
+
+    handlers = handlers or HandlerRegistry()
+    missing = set()
+    def handler(name):
+        """ @return the handler of a name, or `None` if it is not registered """
+        callback = handlers.get(name)
+        if callback is None: missing.add(name)
+        return callback
+
+    game = Engine(header['width'], header['height'], move_function, *header['character'],
+                  pixel_width=header['pixel_width'], character_char=header['character_char'],
+                  map_filler=header['map_filler'], seed=header['seed'], **kwargs)
+    game._timestamp = header['timestamp']
+    version, state, gauss = header['random']
+    game.random.setstate((version, tuple(state), gauss))
+    game.backpack = header['backpack']
+
+    strings = header['strings']
+    tiles = [padded(string, game.pixel_width) for string in strings]
+    items = []
+    gc_enabled = gc.isenabled()
+    gc.disable() # nothing to collect while allocating the items
+    try:
+        properties = ('x', 'y', 'name', 'symbol', 'flags', 'life', 'created')
+        for x, y, name, symbol, flag, life, created in zip(*(columns[name].tolist() for name in properties)):
+            item = Item(strings[name], x, y, created, strings[symbol], None if life == NO_LIFE else life,
+                        bool(flag & BLOCK), bool(flag & HIDDEN), debug=game.debug, parent=game)
+            item.tile = tiles[symbol]
+            if flag & TOUCHED: item.istouched = True
+            items.append(item)
+        buckets = {}
+        for field in ItemRegistry.INDEXED:
+            ordered = [items[i] for i in columns[f'order_{field}'].tolist()]
+            start, buckets[field] = 0, []
+            for size in header['buckets'][field]:
+                buckets[field].append(ordered[start:start + size])
+                start += size
+        for i, z in header['z']:
+            items[i].z = z
+        game._restore_items(items, buckets, [[items[i] for i in stack] for stack in header['stacks']])
+    finally:
+        if gc_enabled: gc.enable()
+    game._touched = [item for item in items if item.istouched]
+    # timers are scheduled in the order they were set up, so those due at the same time fire in the same order
+    timers = [(id, game._restore_life_timer, (items[i],)) for i, id in enumerate(columns['life_timer'].tolist()) if id != NO_LIFE]
+    for column in columns.values(): column.release()
+    for id, due, name in header['timers']:
+        callback = handler(name) if name is not None else None
+        if callback or name is None: timers.append((id, game._restore_timer, (due, callback)))
+    for id, i, due, name in header['item_timers']:
+        callback = handler(name) if name is not None else None
+        if callback or name is None: timers.append((id, items[i]._restore_timer, (due, callback)))
+    timers.sort(key=itemgetter(0))
+    for _, restore, args in timers:
+        restore(*args)
+
+    for event in header['custom_events']:
+        game.add_event(event)
+    game._deferred = header['deferred']
+    for event, name, priority, once in header['events']:
+        callback = handler(name)
+        if callback: game.subscribe(event, callback, priority, once)
+    for event, key, name, priority, once in header['keyboard']:
+        callback = handler(name)
+        if callback: game.subscribe_keyboard(key, event, callback, priority, once)
+    for i, event, name, priority, once in header['item_events']:
+        callback = handler(name)
+        if callback: items[i].subscribe(event, callback, priority, once)
+    entities = {}
+    for id, name, x, y, symbol, block, hidden, move, policy in header['entities']:
+        entity = Entity(id, name, x, y, symbol, handler(move) or game.move_cb if move else game.move_cb,
+                        handler(policy) if policy else None, block, hidden, debug=game.debug, parent=game)
+        entity.tile = padded(symbol, game.pixel_width)
+        game._add_entity(entity)
+        entities[id] = entity
+    game._entity_id = header['entity_id']
+    for id, event, name, priority, once in header['entity_events']:
+        callback = handler(name)
+        if callback: entities[id].subscribe(event, callback, priority, once)
+    for layer, name in header['layers']:
+        renderer = handler(name)
+        if renderer: game.add_layer(layer, renderer)
+    if header['layer'] in game._layer_renderer:
+        game.switch_layer(header['layer'], pause_event_check=False)
+
+    if missing:
+        game.log(f'handlers {sorted(missing)} are not in the handler registry and are not restored', 'warn')
+    return game
+
+def load(path: str, move_function, handlers: HandlerRegistry = None, **kwargs):
+    """ Load an engine from a file. The file is memory-mapped rather than read into a buffer. See `Engine.load` """
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        buffer = memoryview(data)
+        try:
+            return loads(buffer, move_function, handlers, **kwargs)
+        finally:
+            buffer.release()
+
+def _key_name(key) -> str:
+    """ Name of a keyboard key that `Engine.subscribe_keyboard` understands """
+    if isinstance(key, str): return key
+    if getattr(key, 'char', None) is not None: return key.char
+    return getattr(key, 'name', str(key))
+
+def _subscription(name_of, subscription) -> list:
+    """ [handler, priority, once] of a subscription """
+    return [name_of(subscription.callback), subscription.priority, subscription.once]
+
+def _unsupported(engine):
+    def default(value):
+        engine.log(f'{value!r} in the backpack cannot be saved and is stored as a string', 'warn')
+        return repr(value)
+    return default
@@ -0,0 +1,69 @@
+class ItemStack(object):
+    __slots__ = ('x', 'y', 'items', 'name', 'symbol', 'tile', 'block', 'hidden')
+
+    def __init__(self, x: int, y: int, items: list) -> None:
+        """ Items sharing a tile, ordered by their z-order from the bottom to the top.
+        The engine puts a stack on the map in place of a single item once a tile holds more than one item,
+        and the stack answers the same questions as an item, so `map[x][y].block` and `map[x][y].tile` keep working:
+        `symbol` and `tile` are the ones of the topmost visible item, `hidden` is set if no item is visible,
+        `block` is set if any item blocks, and `name` is the one of the top item.
+        They are cached and only computed again when the stack or one of its items changes.
+        @param items - the items in the order to stack them, from the bottom to the top
+        """
+        super().__init__()
+
+        self.x = x
+        self.y = y
+        self.items = list(items)
+        self.refresh()
+
+    @staticmethod
+    def order(item) -> int:
+        """ @return the z-order of an item. Items without a z-order are at 0. """
+        return item.z or 0
+
+    def add(self, item) -> None:
+        """ Put an item on the stack by its z-order. It goes above the items with the same z-order. """
+        items, z = self.items, self.order(item)
+        i = len(items)
+        while i and self.order(items[i - 1]) > z: i -= 1
+        items.insert(i, item)
+        self.refresh()
+
+    def remove(self, item) -> bool:
+        """ Take an item off the stack
+        @return `true` if the item was on the stack
+        """
+        if item not in self.items: return False
+        self.items.remove(item)
+        self.refresh()
+        return True
+
+    def refresh(self) -> None:
+        """ Compute the cached properties again, called after the stack or its items change """
+        items = self.items
+        top = None
+        for item in reversed(items):
+            if not item.hidden:
+                top = item
+                break
+        shown = top or items[-1]
+        self.symbol, self.tile, self.hidden = shown.symbol, shown.tile, top is None
+        self.block = any(item.block for item in items)
+        self.name = items[-1].name
+
+    def top(self):
+        """ @return the item at the top of the stack """
+        return self.items[-1]
+
+    def __contains__(self, item) -> bool:
+        return item in self.items
+
+    def __iter__(self):
+        return iter(list(self.items))
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __repr__(self) -> str:
+        return f'<ItemStack ({self.x}, {self.y}) {[item.name for item in self.items]}>'
@@ -0,0 +1,273 @@
+from collections import OrderedDict
+import importlib.util
+import os
+import pickle
+import shutil
+import tempfile
+# numpy is only imported by the first `ArrayMap`, so games that don't use it don't pay for the import
+NUMPY_AVAILABLE = importlib.util.find_spec('numpy') is not None
+np = None
+
+def _import_numpy():
+    global np
+    if np is None:
+        import numpy
+        np = numpy
+    return np
+
+class ArrayMap(object):
+    def __init__(self, width: int, height: int) -> None:
+        """ Map storage backed by NumPy arrays.
+        The symbol code, block flag and hidden flag of every tile live in `height x width` arrays,
+        so rendering and area queries are vectorized. Items are only kept for occupied tiles.
+        `ArrayMap[x][y]` reads and writes items just like the default `list[list[Item|None]]` map.
+        """
+        super().__init__()
+        _import_numpy()
+
+        self.width = width
+        self.height = height
+        self.items = {}                                      # (x, y) -> item
+        self.code = np.zeros((height, width), dtype=np.int32) # symbol code, 0 for empty tiles
+        self.block = np.zeros((height, width), dtype=bool)
+        self.hidden = np.zeros((height, width), dtype=bool)
+
+        self._symbols = [None]   # code -> symbol
+        self._codes = {}         # symbol -> code
+
+    ### ------ LIST COMPATIBILITY ------ ###
+
+    def __getitem__(self, x: int) -> '_Row':
+        if not -self.height <= x < self.height: raise IndexError('map index out of range')
+        return _Row(self, x % self.height)
+
+    def __iter__(self):
+        for x in range(self.height):
+            yield _Row(self, x)
+
+    def __len__(self) -> int:
+        return self.height
+
+    def get(self, x: int, y: int):
+        """ Get the item on a tile, or `None` """
+        return self.items.get((x, y))
+
+    def set(self, x: int, y: int, item) -> None:
+        """ Put an item on a tile, or clear the tile with `None` """
+        if item is None:
+            self.items.pop((x, y), None)
+            self.code[x, y] = 0
+            self.block[x, y] = False
+            self.hidden[x, y] = False
+            return
+        self.items[x, y] = item
+        self.code[x, y] = self.symbol_code(item.symbol)
+        self.block[x, y] = item.block
+        self.hidden[x, y] = item.hidden
+
+    ### ------ VECTORIZED OPERATIONS ------ ###
+
+    def symbol_code(self, symbol: str) -> int:
+        """ Get the code of a symbol, allocating a new one if needed """
+        code = self._codes.get(symbol)
+        if code is None:
+            code = self._codes[symbol] = len(self._symbols)
+            self._symbols.append(symbol)
+        return code
+
+    def refresh(self, items: list) -> None:
+        """ Copy the symbol, block and hidden state of the given items into the arrays at once """
+        items = [item for item in items if self.items.get((item.x, item.y)) is item]
+        if not items: return
+        xs = np.fromiter((item.x for item in items), dtype=np.intp, count=len(items))
+        ys = np.fromiter((item.y for item in items), dtype=np.intp, count=len(items))
+        self.code[xs, ys] = [self.symbol_code(item.symbol) for item in items]
+        self.block[xs, ys] = [bool(item.block) for item in items]
+        self.hidden[xs, ys] = [bool(item.hidden) for item in items]
+
+    def blocking(self, x0: int, y0: int, x1: int, y1: int) -> list:
+        """ Get the position of every blocking tile in the rectangle [x0, x1) x [y0, y1) """
+        found = np.argwhere(self.block[x0:x1, y0:y1])
+        return [(int(x) + x0, int(y) + y0) for x, y in found]
+
+    def frame(self, tile, filler: str, overlay: dict = None, bounds: tuple = None, mask = None) -> list:
+        """ Render every row of the map into a string.
+        @param tile - function that pads a symbol into a tile
+        @param filler - the tile of empty or hidden tiles
+        @param overlay - tiles to draw on top of the map, {(x, y): tile}
+        @param bounds - only render the rectangle (x0, y0, x1, y1), excluding (x1, y1)
+        @param mask - only render the map on these tiles, {(x, y)}. The others are drawn as the filler.
+        @return a list of rows
+        """
+        x0, y0, x1, y1 = bounds or (0, 0, self.height, self.width)
+        table = np.array([filler] + [tile(symbol) for symbol in self._symbols[1:]], dtype=object)
+        codes = np.where(self.hidden[x0:x1, y0:y1], 0, self.code[x0:x1, y0:y1])
+        if mask is not None:
+            shown = np.zeros(codes.shape, dtype=bool)
+            tiles = [(x - x0, y - y0) for x, y in mask if x0 <= x < x1 and y0 <= y < y1]
+            if tiles: shown[tuple(zip(*tiles))] = True
+            codes[~shown] = 0
+        tiles = table[codes]
+        for (x, y), content in (overlay or {}).items():
+            if x0 <= x < x1 and y0 <= y < y1: tiles[x - x0, y - y0] = content
+        return [''.join(row) for row in tiles]
+
+
+class ChunkMap(object):
+    def __init__(self, chunk_size: int = 64, max_chunks: int = 256, radius: int = 1, path: str = None, handlers = None) -> None:
+        """ Map storage for huge worlds. Pass it to `Engine(map_storage=ChunkMap(...))`.
+        The world is split into `chunk_size x chunk_size` chunks, and only the chunks in use are kept in memory.
+        A chunk is loaded on its first access, and the chunks within `radius` chunks of the character are
+        loaded ahead at the end of every step. Once more than `max_chunks` chunks are loaded,
+        the least recently used ones away from the character are saved into `path` and dropped.
+        Items of a dropped chunk are taken off the engine, so `find_item` and `remove_item(name=...)`
+        only see loaded chunks, and snapshots only cover loaded chunks.
+        When the chunk is loaded again, its items are recreated with new timer ids,
+        and their timers and lifetimes that ran out in the meantime fire at the next step.
+        Their subscriptions and timers are bound again by name through `handlers`, like `snapshot`.
+        @param chunk_size - width and height of a chunk in tiles
+        @param max_chunks - how many chunks may stay in memory, the memory budget of the map
+        @param radius - how many chunks around the character are loaded ahead
+        @param path - directory of the dropped chunks. Default to a new temporary directory, removed by `close`.
+        @param handlers - a `snapshot.HandlerRegistry` to save the callbacks of dropped items by name
+        """
+        super().__init__()
+
+        self.chunk_size = chunk_size
+        self.max_chunks = max_chunks
+        self.radius = radius
+        self.path = path or tempfile.mkdtemp(prefix='game-chunks-')
+        self._temporary = not path          # whether the directory is created here and removed by `close`
+        self.handlers = handlers
+        self.width = self.height = 0
+        self.loads = self.evictions = 0     # how many times chunks are loaded from and saved to the disk
+        self._game = None
+        self._chunks = OrderedDict()        # (cx, cy) -> {(x, y): item}, least recently used first
+        self._stored = set()                # chunks saved on the disk
+
+    def bind(self, game) -> 'ChunkMap':
+        """ Called by the engine that uses this map """
+        os.makedirs(self.path, exist_ok=True)
+        self._game = game
+        self.width, self.height = game.width, game.height
+        if self.handlers is None:
+            from .snapshot import HandlerRegistry
+            self.handlers = HandlerRegistry()
+        return self
+
+    ### ------ LIST COMPATIBILITY ------ ###
+
+    def __getitem__(self, x: int) -> '_Row':
+        if not -self.height <= x < self.height: raise IndexError('map index out of range')
+        return _Row(self, x % self.height)
+
+    def __iter__(self):
+        for x in range(self.height):
+            yield _Row(self, x)
+
+    def __len__(self) -> int:
+        return self.height
+
+    def get(self, x: int, y: int):
+        """ Get the item on a tile, or `None`. The chunk is loaded if it was dropped. """
+        key = (x // self.chunk_size, y // self.chunk_size)
+        chunk = self._chunks.get(key)
+        if chunk is None:
+            if key not in self._stored: return None
+            chunk = self._load(key)
+        return chunk.get((x, y))
+
+    def set(self, x: int, y: int, item) -> None:
+        """ Put an item on a tile, or clear the tile with `None` """
+        key = (x // self.chunk_size, y // self.chunk_size)
+        chunk = self._chunks.get(key)
+        if chunk is None:
+            if item is None and key not in self._stored: return
+            chunk = self._load(key)
+        if item is None: chunk.pop((x, y), None)
+        else:            chunk[x, y] = item
+
+    ### ------ CHUNK MANAGEMENT ------ ###
+
+    def update(self, x: int, y: int) -> None:
+        """ Load the chunks around (x, y), and drop the least recently used chunks beyond the budget.
+        Called by the engine at the end of every step with the position of the character.
+        """
+        cx, cy = x // self.chunk_size, y // self.chunk_size
+        near = [(i, j) for i in range(cx - self.radius, cx + self.radius + 1) 
+                       for j in range(cy - self.radius, cy + self.radius + 1)
+                if 0 <= i * self.chunk_size < self.height and 0 <= j * self.chunk_size < self.width]
+        for key in near:
+            if key in self._chunks: self._chunks.move_to_end(key)
+            elif key in self._stored: self._load(key)
+        if len(self._chunks) <= self.max_chunks: return
+        near = set(near)
+        for key in [key for key in self._chunks if key not in near][:len(self._chunks) - self.max_chunks]:
+            self._evict(key)
+
+    def loaded(self) -> list:
+        """ @return the loaded chunks, least recently used first """
+        return list(self._chunks)
+
+    def close(self) -> None:
+        """ Remove the temporary directory of the dropped chunks, called by the engine after the game ends.
+        Chunks dropped by then are lost. A directory given as `path` is kept.
+        """
+        if not self._temporary: return
+        shutil.rmtree(self.path, ignore_errors=True)
+        self._stored.clear()
+
+    def _load(self, key: tuple) -> dict:
+        """ Load a chunk from the disk, or create an empty one """
+        chunk = self._chunks[key] = {}
+        if key not in self._stored: return chunk
+
+        self._stored.discard(key)
+        with open(self._file(key), 'rb') as f:
+            rows = pickle.load(f)
+        self.loads += 1
+        self._game._reload_items(rows, chunk, self.handlers)
+        return chunk
+
+    def _evict(self, key: tuple) -> None:
+        """ Save a chunk into the disk and drop it from the memory """
+        chunk = self._chunks.pop(key)
+        if not chunk:
+            return
+        rows = self._game._unload_items(list(chunk.values()), self.handlers)
+        with open(self._file(key), 'wb') as f:
+            pickle.dump(rows, f)
+        self._stored.add(key)
+        self.evictions += 1
+
+    def _file(self, key: tuple) -> str:
+        return os.path.join(self.path, f'{key[0]}_{key[1]}.chunk')
+
+
+class _Row(object):
+    """ A row of an `ArrayMap` or `ChunkMap`, so that `map[x][y]` keeps working """
+    __slots__ = ('_map', '_x')
+
+    def __init__(self, map, x: int) -> None:
+        self._map = map
+        self._x = x
+
+    def _index(self, y: int) -> int:
+        if not -self._map.width <= y < self._map.width: raise IndexError('map index out of range')
+        return y % self._map.width
+
+    def __getitem__(self, y: int):
+        return self._map.get(self._x, self._index(y))
+
+    def __setitem__(self, y: int, item) -> None:
+        self._map.set(self._x, self._index(y), item)
+
+    def __iter__(self):
+        for y in range(self._map.width):
+            yield self._map.get(self._x, y)
+
+    def __len__(self) -> int:
+        return self._map.width
+
+    def __repr__(self) -> str:
+        return repr(list(self))
@@ -1,4 +1,5 @@
-from unicodedata import east_asian_width
+from functools import lru_cache
+from unicodedata import east_asian_width, category
 
 def allnone(props):
     try:    it = iter(props)
@@ -10,5 +11,64 @@ def hasnone(props):
     except: it = iter([props])
     return any([content == None for content in it])
 
+def callable_name(fn):
+    return getattr(fn, '__name__', type(fn).__name__)
+
+### ------ DISPLAY WIDTH ------ ###
+
+ZWJ = 0x200D              # zero width joiner, glues emoji into a single glyph
+VS16 = 0xFE0F             # variation selector-16, requests the emoji (wide) presentation
+SKIN_TONE = range(0x1F3FB, 0x1F400)
+
+_bmp_width = None         # display width of every character in the BMP, built on first use
+
+def char_width(code: int) -> int:
+    """ Display width of a single code point: 0 for combining marks, format and control characters,
+    2 for (F)ullwidth and (W)ide characters, and 1 for everything else, including (N)eutral ones.
+    """
+    char = chr(code)
+    if category(char) in ('Mn', 'Me', 'Cf', 'Cc'): return 0
+    if 0xFE00 <= code <= 0xFE0F: return 0
+    return 2 if east_asian_width(char) in 'FW' else 1
+
+def _build_bmp_width() -> bytes:
+    global _bmp_width
+    _bmp_width = bytes(char_width(code) for code in range(0x10000))
+    return _bmp_width
+
+@lru_cache(maxsize=None)
+def _astral_width(code: int) -> int:
+    return char_width(code)
+
 def pixel_width(string):
-    return sum(2 if east_asian_width(char) in 'FNW' else 1 for char in string)
\ No newline at end of file
+    """ Display width of a string in the terminal.
+    Grapheme clusters are measured as a whole: characters joined by a ZWJ and skin tone modifiers
+    add nothing to the emoji they follow, and VS16 widens the narrow character before it.
+    """
+    if string.isascii(): return len(string)
+    table = _bmp_width or _build_bmp_width()
+    width = 0
+    last = 0              # width of the current cluster
+    joined = False        # whether the previous character is a ZWJ
+    for char in string:
+        code = ord(char)
+        if code == ZWJ:
+            joined = True
+            continue
+        if joined:
+            joined = False
+            continue
+        if code == VS16:
+            if last == 1: width, last = width + 1, 2
+            continue
+        if code in SKIN_TONE and last == 2:
+            continue
+        w = table[code] if code < 0x10000 else _astral_width(code)
+        if w: last = w
+        width += w
+    return width
+
+@lru_cache(maxsize=4096)
+def padded(symbol: str, width: int) -> str:
+    """ Right-align a symbol into a tile of the given display width """
+    return ' ' * max(0, width - pixel_width(symbol)) + symbol
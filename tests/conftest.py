@@ -0,0 +1,5 @@
+import os
+import sys
+
+# run the tests against the sources without installing the package
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
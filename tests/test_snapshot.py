@@ -0,0 +1,54 @@
+import pytest
+
+from Game.core import Engine
+from Game.inputs import ScriptedInput
+from Game import snapshot
+
+def move(action, x, y):
+    return [x, y]
+
+def create_game():
+    game = Engine(8, 8, move, input=ScriptedInput([]))
+    for i in range(8):
+        game.add_item('wall', i, 0, '#', block=True)
+    game.add_item('coin', 3, 3, '$', life=10)
+    return game
+
+@pytest.fixture
+def saved(tmp_path):
+    path = tmp_path / 'game.snapshot'
+    create_game().save(str(path))
+    return path
+
+def test_save_and_load(saved):
+    game = Engine.load(str(saved), move, input=ScriptedInput([]))
+    assert len(game.find_item(name='wall')) == 8
+    assert game.map[3][3].name == 'coin'
+
+@pytest.mark.parametrize('size', [0, 4, snapshot.HEADER.size, snapshot.HEADER.size + 10, -16])
+def test_load_truncated(saved, size):
+    # columns are padded to 8 bytes, so cutting the end off by less may leave the data intact
+    data = saved.read_bytes()
+    saved.write_bytes(data[:size])
+    with pytest.raises(ValueError):
+        Engine.load(str(saved), move, input=ScriptedInput([]))
+
+def test_load_wrong_version(saved):
+    data = bytearray(saved.read_bytes())
+    data[len(snapshot.MAGIC)] ^= 0xff
+    saved.write_bytes(bytes(data))
+    with pytest.raises(ValueError):
+        Engine.load(str(saved), move, input=ScriptedInput([]))
+
+def test_load_corrupted_header(saved):
+    data = bytearray(saved.read_bytes())
+    data[snapshot.HEADER.size] = ord('#')
+    saved.write_bytes(bytes(data))
+    with pytest.raises(ValueError):
+        Engine.load(str(saved), move, input=ScriptedInput([]))
+
+def test_loads_releases_the_data(saved):
+    data = bytearray(saved.read_bytes()[:-16])
+    with pytest.raises(ValueError):
+        snapshot.loads(data, move, input=ScriptedInput([]))
+    data.append(0) # fails if a view on the data is still exported